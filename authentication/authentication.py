@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject, empty
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+USER_CACHE_TIMEOUT = 60 * 5
+LOCAL_USER_CACHE_TIMEOUT = 10
+LOCAL_USER_CACHE_SIZE = 1024
+
+_local_users = OrderedDict()
+_local_users_lock = threading.Lock()
+
+
+def user_cache_key(user_id):
+    return f"user_{user_id}_auth"
+
+
+def _get_local(user_id):
+    with _local_users_lock:
+        entry = _local_users.get(user_id)
+        if entry is None:
+            return None
+        data, expires_at = entry
+        if expires_at < time.monotonic():
+            del _local_users[user_id]
+            return None
+        _local_users.move_to_end(user_id)
+        return data
+
+
+def _set_local(user_id, data):
+    with _local_users_lock:
+        _local_users[user_id] = (data, time.monotonic() + LOCAL_USER_CACHE_TIMEOUT)
+        _local_users.move_to_end(user_id)
+        while len(_local_users) > LOCAL_USER_CACHE_SIZE:
+            _local_users.popitem(last=False)
+
+
+class CachedUser(SimpleLazyObject):
+    """User of a token answering ``id`` and ``is_active`` from the cache.
+
+    Anything else loads the user row on first use, once per request; the
+    model class is reported without loading so ``isinstance`` checks and
+    foreign key lookups cost nothing.
+    """
+
+    def __init__(self, user_model, data):
+        self.__dict__['_user_model'] = user_model
+        self.__dict__['_data'] = data
+        super().__init__(lambda: user_model.objects.get(pk=data['id']))
+
+    @property
+    def __class__(self):
+        return self._user_model
+
+    def __getattr__(self, name):
+        if self._wrapped is empty:
+            if name == '_meta':
+                return self._user_model._meta
+            if name != '_state' and not hasattr(self._user_model, name):
+                # Probed by the ORM, e.g. resolve_expression, never set on a fresh instance either
+                raise AttributeError(name)
+            if name in ('id', 'pk'):
+                return self._data['id']
+            if name == 'is_active':
+                return self._data['is_active']
+            if name == 'is_authenticated':
+                return True
+            if name == 'is_anonymous':
+                return False
+        return super().__getattr__(name)
+
+    def __bool__(self):
+        return True
+
+
+def get_user_auth_data(user_model, user_id):
+    """What auth reads of a user, from this process, then Redis, then the database.
+
+    Only the id, the active flag and, when tokens are revoked on password
+    change, the hash of the password hash are cached. The in-process copy
+    lives a few seconds so other workers pick up an invalidation quickly;
+    the Redis copy lives until the user is saved, a few minutes at most.
+    Returns None when the user does not exist.
+    """
+    data = _get_local(user_id)
+    if data is not None:
+        return data
+
+    key = user_cache_key(user_id)
+    data = cache.get(key)
+    if data is None:
+        row = user_model.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).values(
+            'pk', 'is_active', 'password').first()
+        if row is None:
+            return None
+        data = {
+            'id': row['pk'],
+            'is_active': row['is_active'],
+            'password_hash': get_md5_hash_password(row['password']) if api_settings.CHECK_REVOKE_TOKEN else None,
+        }
+        cache.set(key, data, timeout=USER_CACHE_TIMEOUT)
+    _set_local(user_id, data)
+    return data
+
+
+def invalidate_user(user_id):
+    """Drop the cached copies of a user, once the change that called for it is committed."""
+    def invalidate():
+        with _local_users_lock:
+            _local_users.pop(user_id, None)
+        cache.delete(user_cache_key(user_id))
+
+    invalidate()
+    # A request reading the old row before the commit would cache it again
+    transaction.on_commit(invalidate)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication resolving the token's user through the user cache.
+
+    Same checks as ``JWTAuthentication.get_user``, without a query per
+    request once the user is cached. The user returned is a ``CachedUser``.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        data = get_user_auth_data(self.user_model, user_id)
+        if data is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+
+        if not data['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != data['password_hash']:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return CachedUser(self.user_model, data)
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from users.models import User
+from .authentication import invalidate_user
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    """Drop the cached user on any change, password and deactivation included.
+
+    Saving last_login alone, as every login does, changes nothing auth reads.
+    """
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    invalidate_user(instance.pk)
@@ -1,3 +1,38 @@
 from django.test import TestCase
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from users.models import User
+
+LOGIN_URL = '/api/v1/auth/login'
+
+
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        User.objects.create_user('owner', 'C1', 'password')
+        self.client = APIClient()
+
+    def login(self, username, password='wrong', **extra):
+        return self.client.post(LOGIN_URL, {'username': username, 'password': password}, format='json', **extra)
+
+    def test_username_bucket_runs_out_after_its_burst(self):
+        for _ in range(5):
+            self.assertNotEqual(self.login('owner').status_code, 429)
+
+        response = self.login('owner', password='password')
+
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(response.data['success'])
+        self.assertGreater(int(response['Retry-After']), 0)
+        # Other usernames keep their own bucket
+        self.assertNotEqual(self.login('someone').status_code, 429)
+
+    def test_forwarded_for_does_not_pick_a_new_ip_bucket(self):
+        for i in range(30):
+            response = self.login(f'user{i}', HTTP_X_FORWARDED_FOR=f'10.0.0.{i}')
+            self.assertNotEqual(response.status_code, 429)
+
+        response = self.login('user30', HTTP_X_FORWARDED_FOR='10.0.1.1')
+
+        self.assertEqual(response.status_code, 429)
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import time
+from functools import lru_cache
+
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+# Refills the bucket for the time elapsed since the last request, then takes
+# one token when there is one. Returns whether it was taken and the tokens
+# left, as a string so Redis does not truncate it.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local refill = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * refill)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / refill))
+return {allowed, tostring(tokens)}
+"""
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 60 * 60 * 24}
+
+
+@lru_cache(maxsize=None)
+def _token_bucket_script():
+    return get_redis_connection('default').register_script(TOKEN_BUCKET_SCRIPT)
+
+
+def parse_rate(rate):
+    """(capacity, tokens refilled per second) of a DRF style rate such as '5/min'."""
+    num, period = rate.split('/')
+    capacity = int(num)
+    return capacity, capacity / PERIODS[period[0]]
+
+
+def take_token(key, capacity, refill):
+    """Take a token from a bucket atomically; returns whether there was one and the seconds until the next.
+
+    Throttling is best effort: requests go through when Redis is unreachable.
+    """
+    try:
+        allowed, tokens = _token_bucket_script()(keys=[key], args=[capacity, refill, time.time()])
+    except RedisError:
+        return True, None
+    if allowed:
+        return True, None
+    return False, (1 - float(tokens)) / refill
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token bucket per client, shared by every worker through Redis.
+
+    The view's ``throttle_scope`` and the throttle's ``ident_name`` pick the
+    rate in ``DEFAULT_THROTTLE_RATES``, e.g. 'login_ip'. Views or scopes
+    without a rate are not throttled. Throttles run before the handler, so a
+    rejected request never reaches password hashing.
+    """
+    ident_name = None
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+
+    def __init__(self):
+        self.delay = None
+
+    def get_ident_name(self, view):
+        return self.ident_name
+
+    def get_ident_value(self, request, view):
+        raise NotImplementedError('.get_ident_value() must be overridden')
+
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        ident_name = self.get_ident_name(view)
+        if not scope or not ident_name:
+            return True
+        scope = f'{scope}_{ident_name}'
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(scope)
+        if not rate:
+            return True
+
+        ident = self.get_ident_value(request, view)
+        if not ident:
+            return True
+
+        key = self.cache_format % {
+            'scope': scope,
+            'ident': hashlib.sha256(str(ident).encode()).hexdigest()[:32],
+        }
+        allowed, self.delay = take_token(key, *parse_rate(rate))
+        return allowed
+
+    def wait(self):
+        return self.delay
+
+
+class IPThrottle(TokenBucketThrottle):
+    """Token bucket per client IP address.
+
+    X-Forwarded-For is only trusted for the ``NUM_PROXIES`` proxies in
+    front of the app, so clients cannot pick their own bucket.
+    """
+    ident_name = 'ip'
+
+    def get_ident_value(self, request, view):
+        return self.get_ident(request)
+
+
+class BodyFieldThrottle(TokenBucketThrottle):
+    """Token bucket per value of the JSON body field named by the view's ``throttle_field``."""
+
+    def get_ident_name(self, view):
+        return getattr(view, 'throttle_field', None)
+
+    def get_ident_value(self, request, view):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return None
+        value = data.get(view.throttle_field) if isinstance(data, dict) else None
+        return value if isinstance(value, str) else None
@@ -1,6 +1,34 @@
+import json
+from asgiref.sync import sync_to_async
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
+from rest_framework.exceptions import PermissionDenied, Throttled
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from django.contrib.auth.mixins import AccessMixin
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+
+def is_asgi_request(request):
+    """Whether a request, or the Django request behind a DRF one, is served over ASGI."""
+    return isinstance(getattr(request, '_request', request), ASGIRequest)
+
+
+async def iterate_in_thread(iterator):
+    """Async iterator over a sync one, advanced one item at a time in the request's thread.
+
+    Under ASGI a sync iterator is read whole into a list before the
+    response starts; this keeps it streaming. The queryset iterator behind
+    it stays on the thread, and database connection, that opened it.
+    """
+    iterator = iter(iterator)
+    done = object()
+    next_item = sync_to_async(next, thread_sensitive=True)
+    while True:
+        item = await next_item(iterator, done)
+        if item is done:
+            return
+        yield item
 
 
 def get_tokens_for_user(user):
@@ -19,3 +47,74 @@ class APIAccessMixin(AccessMixin):
 
     def handle_no_permission(self):
         return Response({'detail': 'You are not logged in yet'}, status=401)
+
+    def handle_exception(self, exc):
+        # Permission classes deny with the same envelope as the views
+        if isinstance(exc, PermissionDenied):
+            return Response({'success': False, 'message': str(exc.detail)}, status=403)
+        response = super().handle_exception(exc)
+        if isinstance(exc, Throttled):
+            # Keeps the Retry-After header set by DRF
+            response.data = {'success': False, 'message': str(exc.detail)}
+        return response
+
+
+class StreamingListMixin:
+    """ Mixin to return list responses in the {'success', 'data'} envelope.
+        Views setting ``stream_lists`` stream the list from a queryset
+        iterator, chunk by chunk, instead of serializing it in memory.
+        Rows come from ``serializer_class`` or from a ``projection``, a
+        callable turning the queryset into an iterable of ready dicts.
+        ``serializer_context`` is handed to the serializer. Under ASGI the
+        stream is handed out as an async iterator so it is not buffered.
+    """
+    stream_lists = False
+    stream_chunk_size = 500
+
+    def list_response(self, queryset, serializer_class=None, projection=None, serializer_context=None, **extra):
+        if projection is not None:
+            rows = projection(queryset)
+        elif self.stream_lists:
+            rows = self.serialize_chunks(queryset, serializer_class, serializer_context)
+        else:
+            rows = serializer_class(queryset, many=True, context=serializer_context or {}).data
+
+        if not self.stream_lists:
+            return Response({'success': True, 'data': list(rows), **extra}, status=200)
+
+        content = self.stream_list(rows, extra)
+        if is_asgi_request(self.request):
+            content = iterate_in_thread(content)
+        return StreamingHttpResponse(
+            content,
+            content_type='application/json',
+            status=200,
+        )
+
+    def serialize_chunks(self, queryset, serializer_class, serializer_context=None):
+        chunk = []
+        for obj in queryset.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(obj)
+            if len(chunk) == self.stream_chunk_size:
+                yield from serializer_class(chunk, many=True, context=serializer_context or {}).data
+                chunk = []
+        if chunk:
+            yield from serializer_class(chunk, many=True, context=serializer_context or {}).data
+
+    def stream_list(self, rows, extra):
+        yield '{"success": true, "data": ['
+
+        separator = ''
+        encoded = []
+        for row in rows:
+            encoded.append(json.dumps(row, cls=JSONEncoder))
+            if len(encoded) == self.stream_chunk_size:
+                yield separator + ','.join(encoded)
+                separator = ','
+                encoded = []
+        if encoded:
+            yield separator + ','.join(encoded)
+
+        yield ']' + ''.join(
+            f', {json.dumps(key)}: {json.dumps(value, cls=JSONEncoder)}' for key, value in extra.items()
+        ) + '}'
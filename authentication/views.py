@@ -11,10 +11,11 @@ from django.contrib.auth.hashers import check_password
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from authentication.authentication import CachedJWTAuthentication
 from rest_framework_simplejwt.tokens import RefreshToken
 from users.forms import SignUpForm, UserUpdateForm
 from users.models import User
+from authentication.throttling import BodyFieldThrottle, IPThrottle
 from authentication.utils import APIAccessMixin, get_tokens_for_user
 
 
@@ -39,7 +40,7 @@ class CreateUser(APIView):
 
 class UpdateUser(APIAccessMixin, APIView):
     """ Update information of user """
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def put(self, request, *args, **kwargs):
@@ -66,9 +67,12 @@ class UpdateUser(APIAccessMixin, APIView):
             return Response({'success': False, 'message': form.errors}, status=400)
 
 
-class LoginView(APIView):
+class LoginView(APIAccessMixin, APIView):
     """Login to server Backend"""
     permission_classes = [AllowAny]
+    throttle_classes = [IPThrottle, BodyFieldThrottle]
+    throttle_scope = 'login'
+    throttle_field = 'username'
 
     def post(self, request, *args, **kwargs):
         try:
@@ -145,7 +149,7 @@ class LoginView(APIView):
 
 class LogoutView(APIAccessMixin, APIView):
     """ Logout from the server backend """
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
@@ -168,7 +172,7 @@ class LogoutView(APIAccessMixin, APIView):
 
 class AboutMeView(APIAccessMixin, APIView):
     """About me - get all information about user"""
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
@@ -191,7 +195,7 @@ class AboutMeView(APIAccessMixin, APIView):
 
 class ChangePasswordView(APIAccessMixin, APIView):
     """ Change the password of connected user """
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def post(self, request, *args, **kwargs):
@@ -220,9 +224,12 @@ class ChangePasswordView(APIAccessMixin, APIView):
         return Response({'success': True, 'message': 'Password changed successfully'}, status=200)
 
 
-class PasswordReset(APIView):
+class PasswordReset(APIAccessMixin, APIView):
     """Reset password using CNIE."""
     permission_classes = [AllowAny]
+    throttle_classes = [IPThrottle, BodyFieldThrottle]
+    throttle_scope = 'password_reset'
+    throttle_field = 'cnie'
 
     def post(self, request, *args, **kwargs):
         try:
@@ -249,6 +256,8 @@ class PasswordReset(APIView):
 class RefreshTokenView(APIAccessMixin, APIView):
     """Refresh token"""
     permission_classes = [AllowAny]
+    throttle_classes = [IPThrottle]
+    throttle_scope = 'refresh'
 
     def post(self, request, *args, **kwargs):
         try:
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DaretConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'daret'
+
+    def ready(self):
+        from . import signals  # noqa: F401
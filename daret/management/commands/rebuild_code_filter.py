@@ -0,0 +1,23 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django_redis import get_redis_connection
+
+from daret.utils import CODE_FILTER_LOCK_KEY, CODE_FILTER_LOCK_TIMEOUT, rebuild_code_filter
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the Bloom filter used to reject unknown Daret codes; '
+            'run it daily, the filter expires after a day and codes are then looked up in the database')
+
+    def handle(self, *args, **options):
+        redis = get_redis_connection('default')
+        lock_key = cache.make_key(CODE_FILTER_LOCK_KEY)
+        if not redis.set(lock_key, 1, nx=True, ex=CODE_FILTER_LOCK_TIMEOUT):
+            self.stdout.write(self.style.WARNING('codeGroup filter is already being rebuilt'))
+            return
+        try:
+            meta = rebuild_code_filter()
+        finally:
+            redis.delete(lock_key)
+        self.stdout.write(self.style.SUCCESS(
+            f"codeGroup filter rebuilt: {meta['size']} bits, {meta['hashes']} hashes"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from daret.utils import reconcile_participant_counts
+
+
+class Command(BaseCommand):
+    help = 'Recompute nbre_elements of every Daret from its confirmed participants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = reconcile_participant_counts(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"{fixed} Daret counters reconciled"))
@@ -1,7 +1,17 @@
 from django.db import models
+from django.db.models import Exists, OuterRef, Q
 from users.models import User
 
 
+class DaretQuerySet(models.QuerySet):
+    def for_member(self, user):
+        """Darets owned by the user or joined as a confirmed participant."""
+        # EXISTS instead of a join on joinDarets, so no DISTINCT is needed
+        confirmed = JoinDaret.objects.filter(
+            daret=OuterRef('pk'), participant=user, is_confirmed=True)
+        return self.filter(Q(owner=user) | Exists(confirmed)).select_related('owner')
+
+
 class Daret(models.Model):
     owner = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='darets')
@@ -13,6 +23,8 @@ class Daret(models.Model):
     is_done = models.BooleanField(default=False)
     codeGroup = models.CharField(max_length=20, unique=True)
 
+    objects = DaretQuerySet.as_manager()
+
 
 class JoinDaret(models.Model):
     daret = models.ForeignKey(
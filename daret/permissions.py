@@ -0,0 +1,38 @@
+from rest_framework.permissions import BasePermission
+
+from .models import Daret
+from .utils import ROLE_OWNER, ROLE_PARTICIPANT, get_daret_role
+
+MEMBER_ROLES = (ROLE_OWNER, ROLE_PARTICIPANT)
+OWNER_ROLES = (ROLE_OWNER,)
+
+
+class HasDaretRole(BasePermission):
+    """Check the user's role in a Daret against the membership index.
+
+    The view declares ``daret_roles``, a mapping of HTTP method to the roles
+    allowed for it; methods that are not listed are not checked. The Daret is
+    read from the ``daret_url_kwarg`` of the view when it is set, or from the
+    object given to ``check_object_permissions`` (a Daret or any model with a
+    ``daret_id``). No query is issued while the index is cached.
+    """
+    member_message = 'You do not have access to this Daret.'
+    owner_message = 'You are not authorized to manage this Daret.'
+
+    def has_permission(self, request, view):
+        url_kwarg = getattr(view, 'daret_url_kwarg', None)
+        if not url_kwarg or not view.kwargs.get(url_kwarg):
+            return True
+        return self.has_role(request, view, view.kwargs[url_kwarg])
+
+    def has_object_permission(self, request, view, obj):
+        daret_id = obj.pk if isinstance(obj, Daret) else obj.daret_id
+        return self.has_role(request, view, daret_id)
+
+    def has_role(self, request, view, daret_id):
+        roles = getattr(view, 'daret_roles', {}).get(request.method)
+        if roles is None:
+            return True
+
+        self.message = self.owner_message if roles == OWNER_ROLES else self.member_message
+        return get_daret_role(request.user, daret_id) in roles
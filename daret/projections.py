@@ -0,0 +1,25 @@
+from django.db.models import F
+
+PROJECTION_CHUNK_SIZE = 2000
+
+
+def project_join_darets(queryset, chunk_size=PROJECTION_CHUNK_SIZE):
+    """Rows of JoinDaretSerializer for read-only lists, from a single values() query."""
+    rows = queryset.values(
+        'id', 'daret', 'participant', 'is_confirmed', 'created_at',
+        daret_name=F('daret__name'),
+        participant_name=F('participant__username'),
+        participant_first_name=F('participant__first_name'),
+        participant_last_name=F('participant__last_name'),
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield {
+            'id': row['id'],
+            'daret': row['daret'],
+            'daret_name': row['daret_name'],
+            'participant': row['participant'],
+            'participant_name': row['participant_name'],
+            'participant_full_name': f"{row['participant_first_name']} {row['participant_last_name']}",
+            'is_confirmed': row['is_confirmed'],
+            'created_at': row['created_at'],
+        }
@@ -13,6 +13,8 @@ class DaretSerializer(serializers.ModelSerializer):
         model = Daret
         fields = ['id', 'owner', 'full_name', 'name', 'date_start',
                   'mensuel', 'nbre_elements', 'is_part', 'is_done', 'codeGroup']
+        # Maintained by daret.utils.adjust_participant_count
+        read_only_fields = ['nbre_elements']
 
     def get_full_name(self, obj):
         """Get full name for the owner."""
@@ -20,6 +22,15 @@ class DaretSerializer(serializers.ModelSerializer):
             return f"{obj.owner.first_name} {obj.owner.last_name}"
         return None
 
+    def update(self, instance, validated_data):
+        """Write only the edited columns, so concurrent counter updates are kept."""
+        if not validated_data:
+            return instance
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 
 class JoinDaretSerializer(serializers.ModelSerializer):
     participant_name = serializers.CharField(
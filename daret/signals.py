@@ -0,0 +1,23 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Daret, JoinDaret
+from .utils import add_code_group, invalidate_membership
+
+
+@receiver([post_save, post_delete], sender=Daret)
+def daret_changed(sender, instance, **kwargs):
+    """Keep the owner's membership index in sync."""
+    invalidate_membership(instance.owner_id)
+
+
+@receiver(post_save, sender=Daret)
+def daret_saved(sender, instance, created, **kwargs):
+    """Add new or edited codeGroups to the codeGroup filter."""
+    add_code_group(instance.codeGroup, new=created)
+
+
+@receiver([post_save, post_delete], sender=JoinDaret)
+def join_daret_changed(sender, instance, **kwargs):
+    """Keep the participant's membership index in sync."""
+    invalidate_membership(instance.participant_id)
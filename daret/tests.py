@@ -1,3 +1,77 @@
+from datetime import date
+
+from django.core.cache import cache
 from django.test import TestCase
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+
+from users.models import User
+from .models import Daret, JoinDaret
+from tour.utils import card_version_key
+from .utils import CODE_FILTER_META_KEY, rebuild_code_filter, reconcile_participant_counts, resolve_code_group
+
+
+class CodeFilterTests(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.owner = User.objects.create_user('owner', 'C1', 'password')
+        self.daret = Daret.objects.create(
+            owner=self.owner, name='Daret', date_start=date(2025, 1, 1), mensuel=100, codeGroup='KNOWN123')
+
+    def test_unknown_code_is_rejected_without_a_query(self):
+        rebuild_code_filter()
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolve_code_group('UNKNOWN1'))
+
+    def test_known_code_resolves(self):
+        rebuild_code_filter()
+        daret = Daret.objects.create(
+            owner=self.owner, name='Later', date_start=date(2025, 1, 1), mensuel=100, codeGroup='LATER123')
+
+        self.assertEqual(resolve_code_group('KNOWN123'), self.daret)
+        self.assertEqual(resolve_code_group('LATER123'), daret)
+
+    def test_missing_filter_falls_back_to_the_database(self):
+        with self.assertNumQueries(3):
+            self.assertIsNone(resolve_code_group('UNKNOWN1'))
+            self.assertEqual(resolve_code_group('KNOWN123'), self.daret)
+        self.assertFalse(get_redis_connection('default').exists(cache.make_key(CODE_FILTER_META_KEY)))
+
+
+class UpdateDaretTests(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.owner = User.objects.create_user('owner', 'C1', 'password')
+        self.daret = Daret.objects.create(
+            owner=self.owner, name='Daret', date_start=date(2025, 1, 1), mensuel=100, codeGroup='CODE1234')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+
+    def test_joining_returns_the_new_participant_count(self):
+        response = self.client.put(f'/api/v1/daret/{self.daret.id}', {'is_part': True}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['data']['nbre_elements'], 1)
+
+
+class ParticipantCountTests(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.owner = User.objects.create_user('owner', 'C1', 'password')
+        self.darets = [
+            Daret.objects.create(
+                owner=self.owner, name=f'Daret {i}', date_start=date(2025, 1, 1), mensuel=100, codeGroup=f'CODE{i}')
+            for i in range(2)
+        ]
+
+    def test_reconcile_fixes_and_touches_drifted_darets_only(self):
+        JoinDaret.objects.create(daret=self.darets[0], participant=self.owner, is_confirmed=True)
+        versions = [cache.get(card_version_key(daret.id), 0) for daret in self.darets]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reconcile_participant_counts(), 1)
 
-# Create your tests here.
+        self.assertEqual(Daret.objects.get(pk=self.darets[0].pk).nbre_elements, 1)
+        self.assertEqual(
+            [cache.get(card_version_key(daret.id), 0) for daret in self.darets], [versions[0] + 2, versions[1]])
@@ -1,8 +1,247 @@
+import hashlib
+import json
+import math
 import secrets
 import string
 
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django_redis import get_redis_connection
+
+ROLE_OWNER = 'owner'
+ROLE_PARTICIPANT = 'participant'
+ROLE_PENDING = 'pending'
+
+MEMBERSHIP_CACHE_TIMEOUT = 60 * 60  # Rebuilt lazily after one hour at most
+
+CODE_FILTER_TIMEOUT = 60 * 60 * 24  # Rebuild the filter daily, see the rebuild_code_filter command
+CODE_FILTER_KEY = 'daret_code_filter'
+CODE_FILTER_META_KEY = 'daret_code_filter_meta'
+CODE_FILTER_COUNT_KEY = 'daret_code_filter_count'
+CODE_FILTER_PENDING_KEY = 'daret_code_filter_pending'
+CODE_FILTER_LOCK_KEY = 'daret_code_filter_lock'
+CODE_FILTER_LOCK_TIMEOUT = 60 * 10
+CODE_FILTER_BITS_PER_CODE = 10  # About 1% false positives with 7 hashes
+CODE_FILTER_HASHES = 7
+CODE_FILTER_MIN_CAPACITY = 1024
+
 
 def generate_code_group(length=8):
-    """Generates a random alphanumeric code of a given length."""
+    """Generates a random alphanumeric code of a given length.
+
+    Codes that may already be taken according to the codeGroup filter are
+    skipped, so the new code never hits the unique constraint.
+    """
     characters = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(characters) for _ in range(length))
+    while True:
+        code = ''.join(secrets.choice(characters) for _ in range(length))
+        if not code_group_may_exist(code):
+            return code
+
+
+def _code_filter_positions(code, size, hashes):
+    """Bit offsets of a code in the filter (double hashing)."""
+    digest = hashlib.blake2b(code.encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:], 'big') | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+def code_filter_key(size):
+    """Bitmap key of a filter, versioned by its size so bits always match their metadata."""
+    return cache.make_key(f"{CODE_FILTER_KEY}_{size}")
+
+
+def rebuild_code_filter():
+    """Rebuild the Bloom filter of every codeGroup and return its metadata.
+
+    The bitmap, its metadata and its count are written in one MULTI, so
+    readers see either the old filter or the new one.
+    """
+    from .models import Daret
+
+    capacity = max(Daret.objects.count() * 2, CODE_FILTER_MIN_CAPACITY)
+    size = capacity * CODE_FILTER_BITS_PER_CODE
+    bits = bytearray(math.ceil(size / 8))
+    last_id = 0
+    count = 0
+
+    for daret_id, code in Daret.objects.order_by('id').values_list('id', 'codeGroup').iterator(chunk_size=5000):
+        for position in _code_filter_positions(code, size, CODE_FILTER_HASHES):
+            # Redis bitmaps are big-endian within each byte
+            bits[position // 8] |= 0x80 >> (position % 8)
+        last_id = daret_id
+        count += 1
+
+    meta = {'size': size, 'hashes': CODE_FILTER_HASHES, 'capacity': capacity}
+    pipe = get_redis_connection('default').pipeline(transaction=True)
+    # The bitmap outlives its metadata, so readers never see metadata without bits
+    pipe.set(code_filter_key(size), bytes(bits), ex=CODE_FILTER_TIMEOUT * 2)
+    pipe.set(cache.make_key(CODE_FILTER_COUNT_KEY), count)
+    pipe.set(cache.make_key(CODE_FILTER_META_KEY), json.dumps(meta), ex=CODE_FILTER_TIMEOUT)
+    pipe.smembers(cache.make_key(CODE_FILTER_PENDING_KEY))
+    pipe.delete(cache.make_key(CODE_FILTER_PENDING_KEY))
+    pending = pipe.execute()[3]
+
+    # Darets created, and codes edited, while the filter was being built
+    for code in Daret.objects.filter(id__gt=last_id).values_list('codeGroup', flat=True):
+        add_code_group(code, meta)
+    for code in pending:
+        add_code_group(code.decode(), meta, new=False)
+
+    return meta
+
+
+def _code_filter_meta():
+    """Metadata of the filter, None while it is missing.
+
+    Requests never rebuild the filter: they fall back to the database until
+    the rebuild_code_filter command has run.
+    """
+    meta = get_redis_connection('default').get(cache.make_key(CODE_FILTER_META_KEY))
+    return json.loads(meta) if meta is not None else None
+
+
+def add_code_group(code, meta=None, new=True):
+    """Record a codeGroup in the filter; ``new`` codes count toward its capacity."""
+    meta = meta or _code_filter_meta()
+    redis = get_redis_connection('default')
+    if meta is None:
+        # Picked up by the next rebuild, along with the Darets it has not scanned
+        redis.sadd(cache.make_key(CODE_FILTER_PENDING_KEY), code)
+        return
+
+    key = code_filter_key(meta['size'])
+    pipe = redis.pipeline()
+    for position in _code_filter_positions(code, meta['size'], meta['hashes']):
+        pipe.setbit(key, position, 1)
+    if new:
+        pipe.incr(cache.make_key(CODE_FILTER_COUNT_KEY))
+    results = pipe.execute()
+
+    # Past its capacity the filter gets too many false positives, use the database until it is rebuilt
+    if new and results[-1] > meta['capacity']:
+        redis.delete(cache.make_key(CODE_FILTER_META_KEY))
+
+
+def code_group_may_exist(code):
+    """False when the codeGroup is certainly unused, True when it may be taken."""
+    from .models import Daret
+
+    meta = _code_filter_meta()
+    if meta is None:
+        return Daret.objects.filter(codeGroup=code).exists()
+
+    pipe = get_redis_connection('default').pipeline()
+    key = code_filter_key(meta['size'])
+    for position in _code_filter_positions(code, meta['size'], meta['hashes']):
+        pipe.getbit(key, position)
+    return all(pipe.execute())
+
+
+def resolve_code_group(code):
+    """Return the Daret with this codeGroup, or None.
+
+    Unknown codes are rejected by the filter without a query.
+    """
+    from .models import Daret
+
+    if not code or not code_group_may_exist(code):
+        return None
+    return Daret.objects.select_related('owner').filter(codeGroup=code).first()
+
+
+def membership_cache_key(user_id):
+    return f"user_{user_id}_darets"
+
+
+def get_membership(user_id):
+    """Return {daret_id: role} for a user, rebuilding it from the DB on a cache miss."""
+    cache_key = membership_cache_key(user_id)
+    membership = cache.get(cache_key)
+
+    if membership is None:
+        from .models import Daret, JoinDaret
+
+        membership = {
+            daret_id: ROLE_PARTICIPANT if is_confirmed else ROLE_PENDING
+            for daret_id, is_confirmed in JoinDaret.objects.filter(
+                participant_id=user_id).values_list('daret_id', 'is_confirmed')
+        }
+        # Ownership wins over participation
+        membership.update(
+            (daret_id, ROLE_OWNER)
+            for daret_id in Daret.objects.filter(owner_id=user_id).values_list('id', flat=True)
+        )
+        cache.set(cache_key, membership, timeout=MEMBERSHIP_CACHE_TIMEOUT)
+
+    return membership
+
+
+def get_daret_role(user, daret_id):
+    """Role of the user in a Daret, or None when they have no link to it."""
+    try:
+        daret_id = int(daret_id)
+    except (TypeError, ValueError):
+        return None
+    return get_membership(user.id).get(daret_id)
+
+
+def invalidate_membership(*user_ids):
+    """Drop the cached membership of the given users, now and once the change is committed."""
+    keys = [membership_cache_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    # A request reading the old rows before the commit would cache them again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def adjust_participant_count(daret_id, delta):
+    """Atomically add ``delta`` to the participant count of a Daret.
+
+    The increment happens in SQL, so concurrent confirms neither read the row
+    first nor overwrite each other.
+    """
+    from tour.utils import touch_darets
+    from .models import Daret
+
+    if delta:
+        Daret.objects.filter(pk=daret_id).update(
+            nbre_elements=F('nbre_elements') + delta)
+        touch_darets([daret_id])
+
+
+def reconcile_participant_counts(daret_ids=None, chunk_size=1000):
+    """Recompute nbre_elements from confirmed JoinDarets and return the number of fixed Darets.
+
+    Darets are processed in primary key chunks so no statement locks the
+    whole table, and only rows that drifted are written.
+    """
+    from tour.utils import touch_darets
+    from .models import Daret, JoinDaret
+
+    confirmed_count = Coalesce(Subquery(
+        JoinDaret.objects.filter(daret=OuterRef('pk'), is_confirmed=True)
+        .order_by().values('daret').annotate(total=Count('pk')).values('total')
+    ), 0)
+
+    darets = Daret.objects.all()
+    if daret_ids is not None:
+        darets = darets.filter(pk__in=daret_ids)
+
+    fixed = 0
+    last_id = 0
+    while True:
+        chunk = list(darets.filter(pk__gt=last_id).order_by(
+            'pk').values_list('pk', flat=True)[:chunk_size])
+        if not chunk:
+            return fixed
+
+        drifted = Daret.objects.filter(pk__in=chunk).alias(
+            confirmed=confirmed_count).exclude(nbre_elements=F('confirmed'))
+        drifted_ids = list(drifted.values_list('pk', flat=True))
+        if drifted_ids:
+            fixed += drifted.filter(pk__in=drifted_ids).update(nbre_elements=confirmed_count)
+            touch_darets(drifted_ids)
+        last_id = chunk[-1]
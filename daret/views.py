@@ -1,43 +1,48 @@
-from datetime import datetime
+from django.db import transaction
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import SessionAuthentication
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from authentication.authentication import CachedJWTAuthentication
 from authentication.utils import APIAccessMixin
 from django.shortcuts import get_object_or_404
 import json
-from django.db.models import Q
-from tour.models import Tour
-from notifications.utils import create_notification
-from .utils import generate_code_group
+from tour.utils import generate_schedule, touch_darets
+from notifications.messages import (
+    DARET_UPDATED_TEMPLATE, JOIN_CONFIRMED_TEMPLATE, JOIN_REJECTED_TEMPLATE, JOIN_REQUESTED_TEMPLATE,
+)
+from notifications.counters import JOIN_REQUESTS, adjust_counter
+from notifications.models import DARET_UPDATED, JOIN_REQUEST
+from notifications.outbox import enqueue_notification
+from .utils import (
+    ROLE_OWNER, ROLE_PARTICIPANT, ROLE_PENDING, adjust_participant_count,
+    generate_code_group, get_daret_role, invalidate_membership, resolve_code_group,
+)
 from .models import Daret, JoinDaret
+from .permissions import HasDaretRole, MEMBER_ROLES, OWNER_ROLES
 from .serializers import DaretSerializer, JoinDaretSerializer
 
 
 class ManageDaretView(APIAccessMixin, APIView):
     """Manage Darets"""
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, HasDaretRole]
+    daret_url_kwarg = 'id_daret'
+    daret_roles = {'GET': MEMBER_ROLES, 'PUT': OWNER_ROLES, 'DELETE': OWNER_ROLES}
 
     def get(self, request, id_daret=None, *args, **kwargs):
         """Retrieve Darets filtered by the owner or as a participant."""
         user = request.user
 
         if id_daret:
-            # Retrieve a specific Daret by its codeGroup
-            daret = get_object_or_404(Daret, pk=id_daret)
-
-            # Check if the user is either the owner or a participant
-            if daret.owner == user or JoinDaret.objects.filter(daret=daret, participant=user, is_confirmed=True).exists():
-                serializer = DaretSerializer(daret)
-                return Response({'success': True, 'data': serializer.data}, status=200)
-            else:
-                return Response({'success': False, 'message': 'You do not have access to this Daret.'}, status=403)
+            # Access as owner or participant is checked by HasDaretRole
+            daret = get_object_or_404(
+                Daret.objects.select_related('owner'), pk=id_daret)
+            serializer = DaretSerializer(daret)
+            return Response({'success': True, 'data': serializer.data}, status=200)
         else:
             # Retrieve all Darets where the user is the owner or a participant
-            darets = Daret.objects.filter(Q(owner=user) | Q(
-                joinDarets__participant=user, joinDarets__is_confirmed=True)).distinct()
+            darets = Daret.objects.for_member(user)
             serializer = DaretSerializer(darets, many=True)
 
             return Response({'success': True, 'data': serializer.data}, status=200)
@@ -48,16 +53,18 @@ class ManageDaretView(APIAccessMixin, APIView):
 
         if id_daret:
             # Look for an existing Daret by codeGroup
-            daret = get_object_or_404(Daret, codeGroup=id_daret)
+            daret = resolve_code_group(id_daret)
+            if not daret:
+                return Response({'success': False, 'message': 'This group daret not found'}, status=404)
 
-            # Check if the user is already a participant
-            existing_participant = JoinDaret.objects.filter(
-                participant=user, daret=daret).first()
-            if existing_participant:
-                if existing_participant.is_confirmed:
-                    return Response({'success': False, 'message': 'You are already a participant in this Daret'}, status=400)
-                else:
-                    return Response({'success': False, 'message': 'Your request is pending confirmation from the owner.'}, status=400)
+            # Check if the user is the owner or already a participant
+            role = get_daret_role(user, daret.id)
+            if role == ROLE_OWNER:
+                return Response({'success': False, 'message': 'You can not join your own Daret by code.'}, status=400)
+            if role == ROLE_PARTICIPANT:
+                return Response({'success': False, 'message': 'You are already a participant in this Daret'}, status=400)
+            if role == ROLE_PENDING:
+                return Response({'success': False, 'message': 'Your request is pending confirmation from the owner.'}, status=400)
 
             # Create participant data with IDs and set is_confirmed to False
             participant_data = {
@@ -69,17 +76,18 @@ class ManageDaretView(APIAccessMixin, APIView):
             # Serialize and save the participant request
             serializer = JoinDaretSerializer(data=participant_data)
             if serializer.is_valid():
-                serializer.save()
-
-                # Create a notification for the Daret owner
-                create_notification(
-                    user_source=user,  # The participant who is sending the request
-                    user_destination=daret.owner,  # The owner of the Daret
-                    message=(
-                        "{} {} has requested to join your Daret {}"
-                        .format(user.last_name, user.first_name, daret.name)
+                with transaction.atomic():
+                    serializer.save()
+
+                    # Create a notification for the Daret owner
+                    enqueue_notification(
+                        user_source=user,  # The participant who is sending the request
+                        user_destinations=[daret.owner_id],  # The owner of the Daret
+                        template=JOIN_REQUESTED_TEMPLATE,
+                        params={'last_name': user.last_name, 'first_name': user.first_name, 'daret': daret.name},
+                        kind=JOIN_REQUEST,
+                        daret=daret,
                     )
-                )
 
                 return Response({'success': True, 'message': 'Your request to join the Daret has been sent. Awaiting owner confirmation.'}, status=200)
             return Response({'success': False, 'message': serializer.errors}, status=400)
@@ -116,15 +124,13 @@ class ManageDaretView(APIAccessMixin, APIView):
             # Automatically generate a new codeGroup
             data['codeGroup'] = generate_code_group()
 
-            # Set nbre_elements if is_part is True
-            if is_part:
-                data['nbre_elements'] = 1
-
             # Serialize and save the new Daret
             serializer = DaretSerializer(data=data)
             if serializer.is_valid():
 
-                daret_instance = serializer.save(owner=owner)
+                # Set nbre_elements if is_part is True
+                daret_instance = serializer.save(
+                    owner=owner, nbre_elements=1 if is_part else 0)
 
                 # Create the JoinDaret record for the owner if he is part of the group
                 if is_part:
@@ -135,24 +141,17 @@ class ManageDaretView(APIAccessMixin, APIView):
                         is_confirmed=True,
                     )
 
-                    Tour.objects.create(
-                        user=user,
-                        daret=daret_instance,
-                        date_obtenu=datetime.now(),
-                        ordre=1,
-                    )
+                    generate_schedule(daret_instance)
 
                 return Response({'success': True, 'message': 'Daret created successfully'}, status=201)
             return Response({'success': False, 'message': serializer.errors}, status=400)
 
+    @transaction.atomic
     def put(self, request, id_daret, *args, **kwargs):
         """Update an existing Daret"""
-        # Check if the user is the owner of the Daret
+        # Ownership is checked by HasDaretRole
         daret = get_object_or_404(Daret, pk=id_daret)
 
-        if daret.owner != request.user:
-            return Response({'success': False, 'message': 'You are not authorized to update this Daret.'}, status=403)
-
         # Parse JSON body
         try:
             data = json.loads(request.body)
@@ -184,9 +183,6 @@ class ManageDaretView(APIAccessMixin, APIView):
 
             # If the current user changes is_part to true, add to joinDaret and tour
             if is_part:
-                daret.nbre_elements += 1
-                daret.save()
-
                 # Check if the user is already a participant in JoinDaret
                 existing_join_daret = JoinDaret.objects.filter(
                     participant=request.user, daret=updated_daret).first()
@@ -197,60 +193,50 @@ class ManageDaretView(APIAccessMixin, APIView):
                         daret=updated_daret,
                         is_confirmed=True,
                     )
-
-                # Check if the user is already part of the Tour
-                existing_tour_daret = Tour.objects.filter(
-                    # Use daret for Daret reference
-                    user=request.user, daret=updated_daret).first()
-
-                if not existing_tour_daret:
-                    Tour.objects.create(
-                        user=request.user,
-                        daret=updated_daret,  # Correct the field name
-                        date_obtenu=datetime.now(),
-                        ordre=1,
-                    )
-            else:
-                # If the current user changes is_part to false, remove from JoinDaret and Tour
-                daret.nbre_elements -= 1
-                daret.save()
-
-                # Remove user from the Tour
-                # Correct the field name
-                Tour.objects.filter(user=request.user,
-                                    daret=updated_daret).delete()
-
-                # Remove user from JoinDaret
+                    adjust_participant_count(updated_daret.id, 1)
+                elif not existing_join_daret.is_confirmed:
+                    existing_join_daret.is_confirmed = True
+                    existing_join_daret.save()
+                    adjust_participant_count(updated_daret.id, 1)
+
+                # Append the owner's Tour to the rotation
+                generate_schedule(updated_daret)
+            elif is_part is False:
+                # If the current user changes is_part to false, remove from JoinDaret
+                removed = JoinDaret.objects.filter(
+                    participant=request.user, daret=updated_daret, is_confirmed=True).count()
                 JoinDaret.objects.filter(
                     participant=request.user, daret=updated_daret).delete()
+                adjust_participant_count(updated_daret.id, -removed)
+
+                # Drop their Tour and move the next ones up
+                generate_schedule(updated_daret)
 
             # Notify all participants about the Daret update except the owner
             participants = JoinDaret.objects.filter(
                 daret=daret).exclude(participant=request.user)
-            for participant in participants:
-                create_notification(
-                    user_source=request.user,
-                    user_destination=participant.participant,
-                    message=(
-                        "The Daret {} has been updated by {} {}"
-                        .format(daret.name,  request.user.last_name, request.user.first_name)
-                    )
-
-                )
+            enqueue_notification(
+                user_source=request.user,
+                user_destinations=participants.values_list(
+                    'participant_id', flat=True),
+                template=DARET_UPDATED_TEMPLATE,
+                params={'daret': daret.name, 'last_name': request.user.last_name,
+                        'first_name': request.user.first_name},
+                kind=DARET_UPDATED,
+                daret=daret,
+            )
 
+            # nbre_elements was adjusted in the database, not on this instance
+            updated_daret.refresh_from_db(fields=['nbre_elements'])
             return Response({'success': True, 'message': 'Daret updated successfully', 'data': DaretSerializer(updated_daret).data}, status=200)
 
         return Response({'success': False, 'message': serializer.errors}, status=400)
 
     def delete(self, request, id_daret, *args, **kwargs):
         """Delete a Daret"""
-        # Retrieve the Daret or return 404 if not found
+        # Ownership is checked by HasDaretRole
         daret = get_object_or_404(Daret, pk=id_daret)
 
-        # Check if the user is the owner of the Daret
-        if daret.owner != request.user:
-            return Response({'success': False, 'message': 'You are not authorized to delete this Daret.'}, status=403)
-
         # Delete the Daret
         daret.delete()
         return Response({'success': True, 'message': 'Daret deleted successfully'}, status=200)
@@ -258,8 +244,9 @@ class ManageDaretView(APIAccessMixin, APIView):
 
 class ManageJoinDaretView(APIAccessMixin, APIView):
     """Manage request to join Darets"""
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, HasDaretRole]
+    daret_roles = {'PUT': OWNER_ROLES, 'DELETE': OWNER_ROLES}
 
     def get(self, request, id_daret=None, *args, **kwargs):
         """Check if an exist a request to join"""
@@ -312,45 +299,43 @@ class ManageJoinDaretView(APIAccessMixin, APIView):
 
         if id_daret:
 
-            daret = get_object_or_404(Daret, codeGroup=id_daret)
+            daret = resolve_code_group(id_daret)
 
             if not daret:
-                return Response({'success': False, 'message': 'This group daret not found'}, status=400)
+                return Response({'success': False, 'message': 'This group daret not found'}, status=404)
             # Check if the user is the owner of the Daret
-            if daret.owner == user:
+            role = get_daret_role(user, daret.id)
+            if role == ROLE_OWNER:
                 return Response({'success': False, 'message': 'You can not join your own Daret by code.'}, status=400)
 
             # Check if the user is already a participant
-            existing_participant = JoinDaret.objects.filter(
-                participant=user, daret=daret).first()
-            if existing_participant:
-                if existing_participant.is_confirmed:
-                    return Response({'success': False, 'message': 'You are already a participant in this Daret'}, status=400)
-                else:
-                    return Response({'success': False, 'message': 'Your request is pending confirmation from the owner.'}, status=400)
+            if role == ROLE_PARTICIPANT:
+                return Response({'success': False, 'message': 'You are already a participant in this Daret'}, status=400)
+            if role == ROLE_PENDING:
+                return Response({'success': False, 'message': 'Your request is pending confirmation from the owner.'}, status=400)
 
             # Create participant data
             participant_data = {
-                "participant": user,
-                "daret": daret,
+                "participant": user.id,
+                "daret": daret.id,
                 "is_confirmed": False,  # Request pending confirmation
             }
 
             serializer = JoinDaretSerializer(data=participant_data)
             if serializer.is_valid():
-                serializer.save()
-
-                # Notify the Daret owner of the request
-                create_notification(
-                    user_source=user,
-                    user_destination=daret.owner,
-                    message=(
-                        "{} {} has requested to join your Daret {}"
-                        .format(user.last_name,  user.first_name, daret.name)
+                with transaction.atomic():
+                    serializer.save()
+
+                    # Notify the Daret owner of the request
+                    enqueue_notification(
+                        user_source=user,
+                        user_destinations=[daret.owner_id],
+                        template=JOIN_REQUESTED_TEMPLATE,
+                        params={'last_name': user.last_name, 'first_name': user.first_name, 'daret': daret.name},
+                        kind=JOIN_REQUEST,
+                        daret=daret,
                     )
 
-                )
-
                 return Response({'success': True, 'message': 'Join request sent, awaiting owner confirmation.'}, status=200)
 
             return Response({'success': False, 'message': serializer.errors}, status=400)
@@ -360,47 +345,48 @@ class ManageJoinDaretView(APIAccessMixin, APIView):
         user = request.user
 
         # Retrieve the JoinDaret instance and the associated Daret
-        participant_daret = get_object_or_404(JoinDaret, pk=id_daret)
+        participant_daret = get_object_or_404(
+            JoinDaret.objects.select_related('daret', 'participant'), pk=id_daret)
         daret = participant_daret.daret  # Get the Daret directly from JoinDaret
 
         # Check if the user is the owner of the Daret
-        if daret.owner != user:
-            return Response({'success': False, 'message': 'You are not authorized to confirm participants in this Daret.'}, status=403)
-
-        # Confirm the participant
-        if participant_daret.is_confirmed:  # Optional: Check if already confirmed
-            return Response({'success': False, 'message': 'Participant is already confirmed.'}, status=400)
-
-        participant_daret.is_confirmed = True
-        participant_daret.save()
-
-        # Adjust number of elements
-        daret.nbre_elements += 1
-        daret.save()
-
-        # Notify the participant of confirmation
-        create_notification(
-            user_source=daret.owner,
-            user_destination=participant_daret.participant,
-            message=(
-                "Your request to join the Daret group {} has been confirmed."
-                .format(daret.name)
+        self.check_object_permissions(request, participant_daret)
+
+        with transaction.atomic():
+            # Confirm the participant; of concurrent confirms only the one flipping the flag counts it
+            confirmed = JoinDaret.objects.filter(pk=participant_daret.pk, is_confirmed=False).update(is_confirmed=True)
+            if not confirmed:
+                return Response({'success': False, 'message': 'Participant is already confirmed.'}, status=400)
+
+            # Adjust number of elements
+            adjust_participant_count(daret.id, 1)
+
+            # update() sends no signals, keep the caches they maintain in sync
+            invalidate_membership(participant_daret.participant_id)
+            adjust_counter(JOIN_REQUESTS, daret.owner_id, -1)
+            touch_darets([daret.id])
+
+            # Notify the participant of confirmation, fanned out by the outbox workers
+            enqueue_notification(
+                user_source=user,
+                user_destinations=[participant_daret.participant_id],
+                template=JOIN_CONFIRMED_TEMPLATE,
+                params={'daret': daret.name},
             )
 
-        )
-
         return Response({'success': True, 'message': 'Participant confirmed successfully'}, status=200)
 
+    @transaction.atomic
     def delete(self, request, id_daret, *args, **kwargs):
         """Remove request to join a Daret"""
         user = request.user
 
-        participant_daret = get_object_or_404(JoinDaret, pk=id_daret)
+        participant_daret = get_object_or_404(
+            JoinDaret.objects.select_related('daret', 'participant'), pk=id_daret)
         daret = participant_daret.daret
         # daret = get_object_or_404(Daret, pk=participant_daret.daret.pk)
 
-        if daret.owner != user:
-            return Response({'success': False, 'message': 'You are not authorized to remove participants from this Daret.'}, status=403)
+        self.check_object_permissions(request, participant_daret)
 
         # participant_id = request.data.get('participant_id')
         # participant_daret = get_object_or_404(
@@ -408,15 +394,16 @@ class ManageJoinDaretView(APIAccessMixin, APIView):
 
         participant_daret.delete()
 
-        # Notify the participant of removal
-        create_notification(
-            user_source=daret.owner,
-            user_destination=participant_daret.participant,
-            message=(
-                "Your request was rejected to join the Daret group {}."
-                .format(daret.name)
-            )
+        # Confirmed participants were counted in nbre_elements
+        if participant_daret.is_confirmed:
+            adjust_participant_count(daret.id, -1)
 
+        # Notify the participant of removal
+        enqueue_notification(
+            user_source=user,
+            user_destinations=[participant_daret.participant_id],
+            template=JOIN_REJECTED_TEMPLATE,
+            params={'daret': daret.name},
         )
 
         return Response({'success': True, 'message': 'Participant removed successfully'}, status=200)
@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from django.db.models import Count, F, Q
+
+VIREMENTS = 'virements'
+JOIN_REQUESTS = 'join_requests'
+NOTIFICATIONS = 'notifications'
+COUNTERS = (VIREMENTS, JOIN_REQUESTS, NOTIFICATIONS)
+
+COUNTER_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def counter_key(name, user_id):
+    return f"user_{user_id}_{name}_count"
+
+
+def pending_rows(name):
+    """Pending rows behind a counter, with the counted user id as 'user'."""
+    from daret.models import JoinDaret
+    from tour.models import ConfirmVirement
+
+    if name == VIREMENTS:
+        return ConfirmVirement.objects.filter(is_send=False).values(user=F('partie_beneficiaire'))
+    if name == JOIN_REQUESTS:
+        return JoinDaret.objects.filter(is_confirmed=False).values(user=F('daret__owner'))
+    return unread_notifications().values(user=F('user_destination'))
+
+
+def unread_notifications():
+    """Notifications neither flagged read nor under their recipient's read watermark."""
+    from .models import Notification
+
+    return Notification.objects.filter(
+        Q(user_destination__notification_read_mark__isnull=True)
+        | Q(created_at__gt=F('user_destination__notification_read_mark__read_until')),
+        is_read=False,
+    )
+
+
+def get_counts(user_id):
+    """Pending virements, join requests and unread notifications of a user.
+
+    Counters come from the cache; a missing one is counted in the DB once
+    and cached again.
+    """
+    keys = {name: counter_key(name, user_id) for name in COUNTERS}
+    cached = cache.get_many(keys.values())
+
+    counts = {}
+    for name, key in keys.items():
+        if key in cached:
+            counts[name] = max(cached[key], 0)
+        else:
+            counts[name] = pending_rows(name).filter(user=user_id).count()
+            # add() keeps a value set concurrently by another request
+            cache.add(key, counts[name], timeout=COUNTER_CACHE_TIMEOUT)
+    return counts
+
+
+def adjust_counter(name, user_id, delta):
+    """Add delta to a cached counter; a missing counter is left to the DB fallback."""
+    try:
+        cache.incr(counter_key(name, user_id), delta)
+    except ValueError:
+        pass
+
+
+def invalidate_counters(name, user_ids):
+    """Drop counters after bulk writes, they are recounted on next read."""
+    cache.delete_many([counter_key(name, user_id) for user_id in set(user_ids)])
+
+
+def resync_counters():
+    """Recount every counter from the DB with one GROUP BY query each."""
+    for name in COUNTERS:
+        cache.delete_pattern(counter_key(name, '*'))
+        counts = pending_rows(name).order_by().annotate(total=Count('pk')).values_list('user', 'total')
+        cache.set_many(
+            {counter_key(name, user_id): total for user_id, total in counts},
+            timeout=COUNTER_CACHE_TIMEOUT,
+        )
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from notifications.messages import parse_message
+from notifications.models import Notification
+
+
+class Command(BaseCommand):
+    help = 'Store the formatted messages of existing notifications as template ids and params'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of notifications read and updated per batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        compacted = 0
+
+        # Walk the free-text rows by id so every batch is an index range scan
+        while True:
+            batch = list(
+                Notification.objects.filter(template__isnull=True, id__gt=last_id)
+                .order_by('id').only('id', 'message')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            matched = []
+            for notification in batch:
+                parsed = parse_message(notification.message)
+                if parsed is not None:
+                    notification.template, notification.params = parsed
+                    notification.message = ''
+                    matched.append(notification)
+            Notification.objects.bulk_update(matched, ['template', 'params', 'message'])
+            compacted += len(matched)
+
+        self.stdout.write(self.style.SUCCESS(f"{compacted} notifications compacted"))
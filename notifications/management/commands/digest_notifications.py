@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from notifications.utils import digest_notifications
+
+
+class Command(BaseCommand):
+    help = 'Fold unread notifications of the same kind and Daret into one per user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', dest='kinds', action='append', default=None,
+                            help='Only digest this kind, can be repeated')
+
+    def handle(self, *args, **options):
+        removed = digest_notifications(options['kinds'])
+        self.stdout.write(self.style.SUCCESS(f"{removed} notifications folded into digests"))
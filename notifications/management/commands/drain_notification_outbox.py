@@ -0,0 +1,51 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connections
+
+from notifications.outbox import OUTBOX_BATCH_SIZE, drain_outbox
+
+
+def run_worker(batch_size, poll_interval, once):
+    while True:
+        try:
+            handled = drain_outbox(batch_size)
+        except DatabaseError:
+            # Lost connection or lock timeout: the batch was rolled back, retry it
+            connections.close_all()
+            time.sleep(poll_interval)
+            continue
+        if handled < batch_size:
+            if once:
+                return
+            time.sleep(poll_interval)
+
+
+class Command(BaseCommand):
+    help = 'Turn queued notification events into notifications with a pool of workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes')
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE,
+                            help='Number of events handled per transaction')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the outbox is drained instead of polling')
+
+    def handle(self, *args, **options):
+        worker_args = (options['batch_size'], options['poll_interval'], options['once'])
+        if options['workers'] <= 1:
+            run_worker(*worker_args)
+        else:
+            # Forked workers must not share the parent's connections
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            workers = [context.Process(target=run_worker, args=worker_args) for _ in range(options['workers'])]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(self.style.SUCCESS('Notification outbox drained'))
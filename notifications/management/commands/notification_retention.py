@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from notifications.retention import (
+    PARTITION_MONTHS_AHEAD, PURGE_BATCH_SIZE, drop_expired, drop_expired_partitions, ensure_partitions,
+    is_partitioned, purge_cleared, setup_partitioning,
+)
+
+
+class Command(BaseCommand):
+    help = 'Purge cleared notifications, drop expired ones and keep the monthly partitions ahead'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--setup-partitions', action='store_true',
+                            help='Convert the notification table to monthly partitions (PostgreSQL, takes a lock)')
+        parser.add_argument('--months-ahead', type=int, default=PARTITION_MONTHS_AHEAD,
+                            help='Number of future monthly partitions to keep created')
+        parser.add_argument('--retention-months', type=int, default=None,
+                            help='Months of notifications to keep, NOTIFICATION_RETENTION_MONTHS by default')
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE,
+                            help='Number of rows deleted per chunk')
+
+    def handle(self, *args, **options):
+        if options['setup_partitions'] and connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL')
+        if options['setup_partitions'] and not is_partitioned():
+            setup_partitioning(options['months_ahead'])
+            self.stdout.write('Notification table partitioned by month')
+
+        if is_partitioned():
+            created = ensure_partitions(options['months_ahead'])
+            expired = drop_expired_partitions(options['retention_months'])
+            self.stdout.write(f"{len(created)} partitions created, expired partitions dropped: {', '.join(expired) or 'none'}")
+
+        dropped = drop_expired(options['retention_months'], options['batch_size'])
+        purged = purge_cleared(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Expired notifications dropped: {dropped}, cleared notifications purged: {purged}"))
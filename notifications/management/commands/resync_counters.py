@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from notifications.counters import resync_counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the cached pending virement, join request and notification counters'
+
+    def handle(self, *args, **options):
+        resync_counters()
+        self.stdout.write(self.style.SUCCESS('Counters resynced'))
@@ -0,0 +1,81 @@
+import re
+from functools import lru_cache
+
+from django.utils.translation import get_language
+
+# Template ids stored on Notification.template, never reuse a retired one
+JOIN_REQUESTED_TEMPLATE = 1
+JOIN_CONFIRMED_TEMPLATE = 2
+JOIN_REJECTED_TEMPLATE = 3
+DARET_UPDATED_TEMPLATE = 4
+VIREMENT_RECEIVED_TEMPLATE = 5
+PAYMENT_DUE_TEMPLATE = 6
+PAYMENT_OVERDUE_TEMPLATE = 7
+
+DEFAULT_LANGUAGE = 'en'
+
+TEMPLATES = {
+    JOIN_REQUESTED_TEMPLATE: {
+        'en': "{last_name} {first_name} has requested to join your Daret {daret}",
+        'fr': "{last_name} {first_name} a demandé à rejoindre votre Daret {daret}",
+    },
+    JOIN_CONFIRMED_TEMPLATE: {
+        'en': "Your request to join the Daret group {daret} has been confirmed.",
+        'fr': "Votre demande pour rejoindre le groupe Daret {daret} a été confirmée.",
+    },
+    JOIN_REJECTED_TEMPLATE: {
+        'en': "Your request was rejected to join the Daret group {daret}.",
+        'fr': "Votre demande pour rejoindre le groupe Daret {daret} a été refusée.",
+    },
+    DARET_UPDATED_TEMPLATE: {
+        'en': "The Daret {daret} has been updated by {last_name} {first_name}",
+        'fr': "La Daret {daret} a été modifiée par {last_name} {first_name}",
+    },
+    VIREMENT_RECEIVED_TEMPLATE: {
+        'en': "Mr {first_name} {last_name} confirmed that they received money.",
+        'fr': "M. {first_name} {last_name} a confirmé avoir reçu l'argent.",
+    },
+    PAYMENT_DUE_TEMPLATE: {
+        'en': "Your payment for the Daret {daret} is due today.",
+        'fr': "Votre paiement pour la Daret {daret} est dû aujourd'hui.",
+    },
+    PAYMENT_OVERDUE_TEMPLATE: {
+        'en': "Your payment for the Daret {daret} due on {date} is overdue.",
+        'fr': "Votre paiement pour la Daret {daret} dû le {date} est en retard.",
+    },
+}
+
+
+@lru_cache(maxsize=None)
+def template_formatter(template, language):
+    """Formatter of a template in a language, falling back to the default language."""
+    texts = TEMPLATES[template]
+    return texts.get(language, texts[DEFAULT_LANGUAGE]).format_map
+
+
+def render_message(template, params, language=None):
+    """Text of a template with its params, in the given or active language."""
+    language = (language or get_language() or DEFAULT_LANGUAGE).split('-')[0]
+    try:
+        return template_formatter(template, language)(params or {})
+    except KeyError:
+        return ''
+
+
+@lru_cache(maxsize=None)
+def template_pattern(template):
+    """Regex matching the default language text of a template, capturing its params."""
+    parts = re.split(r'\{(\w+)\}', TEMPLATES[template][DEFAULT_LANGUAGE])
+    return re.compile(''.join(
+        re.escape(part) if index % 2 == 0 else f'(?P<{part}>.+?)'
+        for index, part in enumerate(parts)
+    ) + '$')
+
+
+def parse_message(message):
+    """(template, params) of a formatted message, None when no template matches it."""
+    for template in TEMPLATES:
+        match = template_pattern(template).match(message)
+        if match:
+            return template, match.groupdict()
+    return None
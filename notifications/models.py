@@ -1,5 +1,22 @@
 from django.db import models
+from django.db.models import F, Q
+from daret.models import Daret
 from users.models import User
+from .messages import render_message
+
+# Kinds of notifications that can be merged, blank for the others
+JOIN_REQUEST = 'join_request'
+VIREMENT_RECEIVED = 'virement_received'
+DARET_UPDATED = 'daret_updated'
+
+
+class NotificationQuerySet(models.QuerySet):
+    def visible(self):
+        """Notifications their recipient has not cleared, the cleared ones wait to be purged."""
+        return self.filter(
+            Q(user_destination__notification_read_mark__cleared_until__isnull=True)
+            | Q(created_at__gt=F('user_destination__notification_read_mark__cleared_until'))
+        )
 
 
 class Notification(models.Model):
@@ -9,13 +26,79 @@ class Notification(models.Model):
     user_destination = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='received_notifications'
     )
-    message = models.TextField()
+    # Free text, empty when the notification is rendered from a template
+    message = models.TextField(blank=True, default='')
+    template = models.PositiveSmallIntegerField(null=True, blank=True)
+    params = models.JSONField(null=True, blank=True)
+    kind = models.CharField(max_length=30, blank=True, default='')
+    daret = models.ForeignKey(
+        Daret, on_delete=models.SET_NULL, null=True, blank=True, related_name='notifications'
+    )
+    # Number of events merged into this notification, its message is the latest one
+    count = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     is_read = models.BooleanField(default=False)
 
+    objects = NotificationQuerySet.as_manager()
+
     def __str__(self):
-        return f"Notification from {self.user_source.username} to {self.user_destination.username}: {self.message[:20]}"
+        return f"Notification from {self.user_source.username} to {self.user_destination.username}: {self.rendered_message[:20]}"
+
+    @property
+    def rendered_message(self):
+        """Text of the notification, rendered from its template in the active language."""
+        if self.template is None:
+            return self.message
+        return render_message(self.template, self.params)
 
     class Meta:
         # Order notifications by creation date, latest first
         ordering = ['-created_at']
+        indexes = [
+            # Range scans of a user's notifications by (created_at, id) for keyset pagination
+            models.Index(fields=['user_destination', 'created_at', 'id'], name='notification_dest_created_idx'),
+            # Lookup of the unread row a new event is merged into
+            models.Index(fields=['user_destination', 'kind', 'daret', 'is_read'], name='notification_coalesce_idx'),
+        ]
+
+
+class NotificationReadMark(models.Model):
+    """Notification watermarks of a user.
+
+    Every notification created up to ``read_until`` counts as read, and up
+    to ``cleared_until`` as deleted until the retention job purges it.
+    """
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name='notification_read_mark'
+    )
+    read_until = models.DateTimeField()
+    cleared_until = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"Notifications of {self.user_id} read until {self.read_until}"
+
+
+class NotificationEvent(models.Model):
+    """Outbox record of a notification to fan out, written in the transaction of the request.
+
+    The ``drain_notification_outbox`` workers turn it into Notification rows
+    and delete it; a failed attempt is retried later.
+    """
+    user_source = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='notification_events'
+    )
+    user_destinations = models.JSONField()
+    message = models.TextField(blank=True, default='')
+    template = models.PositiveSmallIntegerField(null=True, blank=True)
+    params = models.JSONField(null=True, blank=True)
+    kind = models.CharField(max_length=30, blank=True, default='')
+    daret = models.ForeignKey(
+        Daret, on_delete=models.CASCADE, null=True, blank=True, related_name='notification_events'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    available_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"Notification event from {self.user_source_id} to {len(self.user_destinations)} users"
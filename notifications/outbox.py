@@ -0,0 +1,81 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from daret.models import Daret
+from users.models import User
+from .models import NotificationEvent
+from .utils import create_notifications
+
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 10
+OUTBOX_MAX_BACKOFF = timedelta(hours=1)
+
+
+def enqueue_notification(user_source, user_destinations, message='', kind='', daret=None, template=None, params=None):
+    """Queue a notification for many users with a single outbox insert.
+
+    Takes the arguments of ``create_notifications``; called inside the
+    request's transaction, the event is only queued if the request commits.
+    """
+    if isinstance(user_destinations, QuerySet):
+        if user_destinations.model is User and not user_destinations._fields:
+            user_destinations = user_destinations.values_list('pk', flat=True)
+    user_destinations = [
+        user_destination.pk if isinstance(user_destination, User) else user_destination
+        for user_destination in user_destinations
+    ]
+    if not user_destinations:
+        return None
+
+    return NotificationEvent.objects.create(
+        user_source_id=user_source.pk if isinstance(user_source, User) else user_source,
+        user_destinations=user_destinations,
+        message=message,
+        template=template,
+        params=params,
+        kind=kind,
+        daret_id=daret.pk if isinstance(daret, Daret) else daret,
+    )
+
+
+def retry_delay(attempts):
+    return min(timedelta(seconds=10 * 2 ** attempts), OUTBOX_MAX_BACKOFF)
+
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    """Turn one batch of due outbox events into notifications and return how many were handled.
+
+    Events are locked with SKIP LOCKED so workers never take the same one.
+    Each event runs in its own savepoint: a failing one is pushed back with
+    an exponential delay while the others go through. An event is deleted
+    in the transaction that creates its notifications, and given up after
+    ``OUTBOX_MAX_ATTEMPTS``.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            NotificationEvent.objects.select_for_update(skip_locked=True)
+            .filter(available_at__lte=now, attempts__lt=OUTBOX_MAX_ATTEMPTS)
+            .order_by('id')[:batch_size]
+        )
+
+        done = []
+        for event in events:
+            try:
+                with transaction.atomic():
+                    create_notifications(
+                        event.user_source_id, event.user_destinations, event.message,
+                        kind=event.kind, daret=event.daret_id, template=event.template, params=event.params,
+                    )
+                done.append(event.pk)
+            except Exception as e:
+                event.attempts += 1
+                event.available_at = now + retry_delay(event.attempts)
+                event.last_error = str(e)
+                event.save(update_fields=['attempts', 'available_at', 'last_error'])
+
+        NotificationEvent.objects.filter(pk__in=done).delete()
+    return len(events)
@@ -0,0 +1,90 @@
+import json
+
+from django.conf import settings
+from django.db import transaction
+from django_redis import get_redis_connection
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
+from rest_framework.utils.encoders import JSONEncoder
+
+from users.models import User
+
+PUSH_KEEPALIVE_SECONDS = 15
+
+
+def push_channel(user_id):
+    return f"user_{user_id}_notifications"
+
+
+def publish_notifications(notifications):
+    """Publish notifications to their recipients' channels once the transaction commits.
+
+    Any worker holding a recipient's stream delivers them. Push is best
+    effort: clients catch up through ``since`` when Redis is unreachable.
+    """
+    if not notifications:
+        return
+
+    user_ids = {n.user_source_id for n in notifications} | {n.user_destination_id for n in notifications}
+    usernames = dict(User.objects.filter(pk__in=user_ids).values_list('pk', 'username'))
+
+    # Same shape as NotificationSerializer, with every username read in one query
+    payloads = [
+        (push_channel(n.user_destination_id), json.dumps({
+            'id': n.id,
+            'user_source': n.user_source_id,
+            'user_source_username': usernames.get(n.user_source_id),
+            'user_destination': n.user_destination_id,
+            'user_destination_username': usernames.get(n.user_destination_id),
+            'message': n.rendered_message,
+            'kind': n.kind,
+            'daret': n.daret_id,
+            'count': n.count,
+            'created_at': n.created_at,
+            'is_read': n.is_read,
+            # Id of the coalesced notification this one replaces
+            'replaces': getattr(n, 'replaces', None),
+        }, cls=JSONEncoder))
+        for n in notifications
+    ]
+    transaction.on_commit(lambda: _publish(payloads))
+
+
+def _publish(payloads):
+    try:
+        pipeline = get_redis_connection('default').pipeline(transaction=False)
+        for channel, payload in payloads:
+            pipeline.publish(channel, payload)
+        pipeline.execute()
+    except RedisError:
+        pass
+
+
+def sse_event(payload, event='notification'):
+    data = json.loads(payload)
+    return f"id: {data['id']}\nevent: {event}\ndata: {payload}\n\n"
+
+
+async def stream_notifications(user_id, backlog=()):
+    """Server-Sent Events of a user's notifications, as they are published.
+
+    ``backlog`` holds serialized notifications missed since the client's
+    Last-Event-ID; they are sent first. A comment line is sent when idle so
+    proxies keep the connection open.
+    """
+    client = aioredis.from_url(settings.CACHES['default']['LOCATION'])
+    pubsub = client.pubsub()
+    try:
+        await pubsub.subscribe(push_channel(user_id))
+        for data in backlog:
+            yield sse_event(json.dumps(data, cls=JSONEncoder))
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=PUSH_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ': keep-alive\n\n'
+            else:
+                yield sse_event(message['data'].decode())
+    finally:
+        await pubsub.aclose()
+        await client.aclose()
@@ -0,0 +1,210 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .counters import NOTIFICATIONS, counter_key, invalidate_counters
+from .models import Notification, NotificationReadMark
+from .utils import delete_notifications
+
+PURGE_BATCH_SIZE = 1000
+PARTITION_MONTHS_AHEAD = 3
+
+TABLE = Notification._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+PARTITION_NAME = re.compile(rf"^{TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+def month_start(year, month):
+    """First instant of a month in UTC, months past 12 roll over to the next years."""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start):
+    return f"{TABLE}_y{start.year:04d}m{start.month:02d}"
+
+
+def clear_all(user):
+    """Hide every notification of a user at once by moving their clear watermark.
+
+    The rows are deleted later, in bounded chunks, by ``purge_cleared``.
+    Cleared notifications count as read too.
+    """
+    cleared_until = Notification.objects.filter(user_destination=user).aggregate(
+        cleared_until=Max('created_at'))['cleared_until']
+    if cleared_until is not None:
+        NotificationReadMark.objects.update_or_create(
+            user=user, defaults={'read_until': cleared_until, 'cleared_until': cleared_until})
+        invalidate_counters(NOTIFICATIONS, [user.pk])
+    return cleared_until
+
+
+def _delete_chunk(queryset, batch_size):
+    # Cleared rows count as read, and drop_expired recounts after deleting expired ones
+    return delete_notifications(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+
+
+def purge_cleared(batch_size=PURGE_BATCH_SIZE):
+    """Delete the notifications users cleared, one short transaction per chunk."""
+    purged = 0
+    for user_id, cleared_until in NotificationReadMark.objects.filter(
+            cleared_until__isnull=False).values_list('user_id', 'cleared_until').iterator():
+        cleared = Notification.objects.filter(user_destination_id=user_id, created_at__lte=cleared_until)
+        while True:
+            deleted = _delete_chunk(cleared, batch_size)
+            purged += deleted
+            if deleted < batch_size:
+                break
+        # Done unless the user cleared again meanwhile
+        NotificationReadMark.objects.filter(user_id=user_id, cleared_until=cleared_until).update(cleared_until=None)
+    return purged
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+@transaction.atomic
+def setup_partitioning(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Turn the notification table into one range-partitioned by month of ``created_at``.
+
+    PostgreSQL only. The table is rebuilt and its rows copied under lock,
+    so run it in a maintenance window. The primary key becomes
+    ``(id, created_at)`` as PostgreSQL requires; ids stay unique through
+    their sequence.
+    """
+    old = f"{TABLE}_unpartitioned"
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE "{TABLE}" RENAME TO "{old}"')
+        cursor.execute(
+            f'CREATE TABLE "{TABLE}" (LIKE "{old}" INCLUDING DEFAULTS INCLUDING IDENTITY) '
+            f'PARTITION BY RANGE (created_at)')
+        cursor.execute(f'CREATE TABLE "{DEFAULT_PARTITION}" PARTITION OF "{TABLE}" DEFAULT')
+
+        cursor.execute(f'SELECT MIN(created_at) FROM "{old}"')
+        oldest = cursor.fetchone()[0] or timezone.now()
+        start = month_start(oldest.year, oldest.month)
+        now = timezone.now()
+        while start <= month_start(now.year, now.month + months_ahead):
+            end = month_start(start.year, start.month + 1)
+            cursor.execute(
+                f'CREATE TABLE "{partition_name(start)}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)',
+                [start, end])
+            start = end
+
+        cursor.execute(f'INSERT INTO "{TABLE}" SELECT * FROM "{old}"')
+        cursor.execute(
+            f"SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT COALESCE(MAX(id), 0) + 1 FROM \"{old}\"), false)",
+            [TABLE])
+        cursor.execute(f'DROP TABLE "{old}"')
+
+        # Constraints and indexes come once the old ones and their names are gone
+        cursor.execute(f'ALTER TABLE "{TABLE}" ADD PRIMARY KEY (id, created_at)')
+        for field in Notification._meta.concrete_fields:
+            if field.remote_field is not None:
+                target = field.remote_field.model._meta.db_table
+                cursor.execute(f'CREATE INDEX ON "{TABLE}" ("{field.column}")')
+                cursor.execute(
+                    f'ALTER TABLE "{TABLE}" ADD FOREIGN KEY ("{field.column}") '
+                    f'REFERENCES "{target}" ("{field.target_field.column}") DEFERRABLE INITIALLY DEFERRED')
+
+    with connection.schema_editor(atomic=False) as schema_editor:
+        for index in Notification._meta.indexes:
+            schema_editor.add_index(Notification, index)
+
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD):
+    """Create the monthly partitions of the coming months, returns the names created.
+
+    Rows the default partition already caught for such a month are moved
+    into the new partition, with the default one detached meanwhile.
+    """
+    created = []
+    now = timezone.now()
+    for offset in range(months_ahead + 1):
+        start = month_start(now.year, now.month + offset)
+        end = month_start(start.year, start.month + 1)
+        name = partition_name(start)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [name])
+            if cursor.fetchone()[0] is not None:
+                continue
+            cursor.execute(
+                f'SELECT EXISTS (SELECT 1 FROM "{DEFAULT_PARTITION}" WHERE created_at >= %s AND created_at < %s)',
+                [start, end])
+            caught = cursor.fetchone()[0]
+            if caught:
+                cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{DEFAULT_PARTITION}"')
+            cursor.execute(
+                f'CREATE TABLE "{name}" PARTITION OF "{TABLE}" FOR VALUES FROM (%s) TO (%s)', [start, end])
+            if caught:
+                cursor.execute(
+                    f'WITH moved AS (DELETE FROM "{DEFAULT_PARTITION}" WHERE created_at >= %s AND created_at < %s '
+                    f'RETURNING *) INSERT INTO "{TABLE}" SELECT * FROM moved', [start, end])
+                cursor.execute(f'ALTER TABLE "{TABLE}" ATTACH PARTITION "{DEFAULT_PARTITION}" DEFAULT')
+        created.append(name)
+    return created
+
+
+def expiry_cutoff(retention_months=None):
+    """Start of the oldest month still kept."""
+    if retention_months is None:
+        retention_months = settings.NOTIFICATION_RETENTION_MONTHS
+    now = timezone.now()
+    return month_start(now.year, now.month - retention_months)
+
+
+def drop_expired_partitions(retention_months=None):
+    """Detach and drop the monthly partitions past the retention period, returns their names.
+
+    Takes no row locks and leaves no bloat. PostgreSQL partitioned table only.
+    """
+    cutoff = expiry_cutoff(retention_months)
+    dropped = []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(%s)", [TABLE])
+        partitions = [row[0] for row in cursor.fetchall()]
+        for name in sorted(partitions):
+            match = PARTITION_NAME.match(name)
+            if match and month_start(int(match[1]), int(match[2]) + 1) <= cutoff:
+                cursor.execute(f'ALTER TABLE "{TABLE}" DETACH PARTITION "{name}"')
+                cursor.execute(f'DROP TABLE "{name}"')
+                dropped.append(name)
+
+    if dropped:
+        # Dropped rows may have been unread, recount every notification counter on next read
+        cache.delete_pattern(counter_key(NOTIFICATIONS, '*'))
+    return dropped
+
+
+def drop_expired(retention_months=None, batch_size=PURGE_BATCH_SIZE):
+    """Delete the notifications older than the retention period in bounded chunks, returns their number.
+
+    On a partitioned table, run ``drop_expired_partitions`` first: this then
+    only deletes what the default partition caught.
+    """
+    expired = Notification.objects.filter(created_at__lt=expiry_cutoff(retention_months))
+    removed = 0
+    while True:
+        deleted = _delete_chunk(expired, batch_size)
+        removed += deleted
+        if deleted < batch_size:
+            break
+
+    if removed:
+        # Dropped rows may have been unread, recount every notification counter on next read
+        cache.delete_pattern(counter_key(NOTIFICATIONS, '*'))
+    return removed
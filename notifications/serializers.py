@@ -11,6 +11,15 @@ class NotificationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'user_source', 'user_source_username', 'user_destination',
-                  'user_destination_username', 'message', 'created_at', 'is_read']
+                  'user_destination_username', 'message', 'kind', 'daret', 'count', 'created_at', 'is_read']
         read_only_fields = ['user_source',
-                            'user_source_username', 'created_at', 'is_read']
+                            'user_source_username', 'kind', 'daret', 'count', 'created_at', 'is_read']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['message'] = instance.rendered_message
+        # Notifications under the user's read watermark are read
+        read_until = self.context.get('read_until')
+        if read_until is not None and instance.created_at <= read_until:
+            data['is_read'] = True
+        return data
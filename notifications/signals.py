@@ -0,0 +1,75 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from daret.models import Daret, JoinDaret
+from tour.models import ConfirmVirement
+from .counters import JOIN_REQUESTS, NOTIFICATIONS, VIREMENTS, adjust_counter, invalidate_counters
+from .models import Notification
+from .utils import is_under_read_mark
+
+# Model -> (counter, field whose False value makes the row pending)
+COUNTED_MODELS = {
+    Notification: (NOTIFICATIONS, 'is_read'),
+    ConfirmVirement: (VIREMENTS, 'is_send'),
+    JoinDaret: (JOIN_REQUESTS, 'is_confirmed'),
+}
+
+
+def counted_user_id(instance):
+    """User whose counter the row belongs to."""
+    if isinstance(instance, Notification):
+        return instance.user_destination_id
+    if isinstance(instance, ConfirmVirement):
+        return instance.partie_beneficiaire_id
+    if JoinDaret.daret.is_cached(instance):
+        return instance.daret.owner_id
+    return Daret.objects.filter(pk=instance.daret_id).values_list('owner_id', flat=True).first()
+
+
+def is_pending(instance):
+    return not getattr(instance, COUNTED_MODELS[type(instance)][1])
+
+
+def update_counter(instance, delta, created=False):
+    name = COUNTED_MODELS[type(instance)][0]
+    if delta is None:
+        # State unknown, recount on next read
+        invalidate_counters(name, [counted_user_id(instance)])
+    elif delta and (created or not (isinstance(instance, Notification) and is_under_read_mark(instance))):
+        # A notification under the read watermark was never counted, a new one is always above it
+        adjust_counter(name, counted_user_id(instance), delta)
+
+
+@receiver(pre_save, sender=Notification)
+@receiver(pre_save, sender=ConfirmVirement)
+@receiver(pre_save, sender=JoinDaret)
+def remember_pending(sender, instance, update_fields=None, **kwargs):
+    """Read whether the stored row is counted, only when the save may change it."""
+    field = COUNTED_MODELS[sender][1]
+    if instance.pk is None:
+        instance._counted_pending = False
+    elif update_fields is not None and field not in update_fields:
+        # The flag is not written, the counter cannot move
+        instance._counted_pending = None
+    else:
+        stored = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+        instance._counted_pending = stored is not None and not stored
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_save, sender=ConfirmVirement)
+@receiver(post_save, sender=JoinDaret)
+def count_saved(sender, instance, created, **kwargs):
+    was_pending = instance.__dict__.pop('_counted_pending', None)
+    if was_pending is not None:
+        update_counter(instance, int(is_pending(instance)) - int(was_pending), created)
+
+
+@receiver(post_delete, sender=Notification)
+@receiver(post_delete, sender=ConfirmVirement)
+@receiver(post_delete, sender=JoinDaret)
+def count_deleted(sender, instance, **kwargs):
+    if COUNTED_MODELS[sender][1] in instance.get_deferred_fields():
+        update_counter(instance, None)
+    elif is_pending(instance):
+        update_counter(instance, -1)
@@ -1,3 +1,177 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from daret.models import Daret, JoinDaret
+from tour.models import ConfirmVirement, Tour
+from users.models import User
+from .counters import JOIN_REQUESTS, NOTIFICATIONS, VIREMENTS, get_counts
+from .models import DARET_UPDATED, JOIN_REQUEST, Notification, NotificationEvent
+from .outbox import OUTBOX_MAX_ATTEMPTS, drain_outbox, enqueue_notification
+from .retention import clear_all, purge_cleared
+from .utils import create_notification, create_notifications, newer_notifications
+
+
+@override_settings(NOTIFICATION_COALESCE_WINDOW=3600)
+class CoalescingTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('owner', 'C1', 'password')
+        self.member = User.objects.create_user('member', 'C2', 'password')
+        self.daret = Daret.objects.create(
+            owner=self.owner, name='Daret', date_start=date(2025, 1, 1), mensuel=100, codeGroup='CODE')
+
+    def test_merged_notification_is_seen_after_since(self):
+        first = create_notification(self.member, self.owner, 'join 1', kind=JOIN_REQUEST, daret=self.daret)
+        second = create_notification(self.member, self.owner, 'update', kind=DARET_UPDATED, daret=self.daret)
+        third = create_notification(self.member, self.owner, 'free text')
+        merged = create_notification(self.member, self.owner, 'join 2', kind=JOIN_REQUEST, daret=self.daret)
+
+        page, has_more = newer_notifications(Notification.objects.filter(user_destination=self.owner), first.id)
+
+        self.assertEqual([n.id for n in page], [second.id, third.id, merged.id])
+        self.assertFalse(has_more)
+        self.assertEqual(page[-1].count, 2)
+        self.assertEqual(page[-1].message, 'join 2')
+        self.assertFalse(Notification.objects.filter(pk=first.id).exists())
+
+    def test_read_notification_is_not_merged(self):
+        first = create_notification(self.member, self.owner, 'join 1', kind=JOIN_REQUEST, daret=self.daret)
+        Notification.objects.filter(pk=first.pk).update(is_read=True)
+
+        second = create_notification(self.member, self.owner, 'join 2', kind=JOIN_REQUEST, daret=self.daret)
+
+        self.assertEqual(second.count, 1)
+        self.assertIsNone(second.replaces)
+        self.assertTrue(Notification.objects.filter(pk=first.pk).exists())
+
+    def test_notifications_outlive_their_daret(self):
+        notification = create_notification(self.member, self.owner, 'join', kind=JOIN_REQUEST, daret=self.daret)
+
+        self.daret.delete()
+
+        notification.refresh_from_db()
+        self.assertIsNone(notification.daret_id)
+
+
+class CounterTests(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.owner = User.objects.create_user('owner', 'C1', 'password')
+        self.member = User.objects.create_user('member', 'C2', 'password')
+        self.daret = Daret.objects.create(
+            owner=self.owner, name='Daret', date_start=date(2025, 1, 1), mensuel=100, codeGroup='CODE')
+        # Cache every counter, so the signals adjust them instead of leaving them to a recount
+        get_counts(self.owner.id)
+
+    def test_new_notification_is_counted_without_extra_queries(self):
+        with self.assertNumQueries(1):
+            notification = Notification.objects.create(
+                user_source=self.member, user_destination=self.owner, message='hello')
+
+        self.assertEqual(get_counts(self.owner.id)[NOTIFICATIONS], 1)
+
+        notification.is_read = True
+        notification.save(update_fields=['is_read'])
+        self.assertEqual(get_counts(self.owner.id)[NOTIFICATIONS], 0)
+
+    def test_save_leaving_the_flag_alone_reads_nothing(self):
+        notification = Notification.objects.create(
+            user_source=self.member, user_destination=self.owner, message='hello')
+
+        notification.message = 'edited'
+        with self.assertNumQueries(1):
+            notification.save(update_fields=['message'])
+
+        self.assertEqual(get_counts(self.owner.id)[NOTIFICATIONS], 1)
+
+    def test_join_requests_follow_confirm_and_delete(self):
+        first = JoinDaret.objects.create(daret=self.daret, participant=self.member)
+        second = JoinDaret.objects.create(
+            daret=self.daret, participant=User.objects.create_user('other', 'C3', 'password'))
+        self.assertEqual(get_counts(self.owner.id)[JOIN_REQUESTS], 2)
+
+        # Saving a row loaded from the database diffs against the stored flag
+        loaded = JoinDaret.objects.get(pk=first.pk)
+        loaded.is_confirmed = True
+        loaded.save()
+        self.assertEqual(get_counts(self.owner.id)[JOIN_REQUESTS], 1)
+
+        second.delete()
+        self.assertEqual(get_counts(self.owner.id)[JOIN_REQUESTS], 0)
+
+    def test_sent_virement_leaves_the_counter(self):
+        tour = Tour.objects.create(daret=self.daret, user=self.owner, date_obtenu=date(2025, 1, 1), ordre='1')
+        virement = ConfirmVirement.objects.create(
+            tour=tour, partie_beneficiaire=self.owner, partie_donnenant=self.member)
+        self.assertEqual(get_counts(self.owner.id)[VIREMENTS], 1)
+
+        virement.is_send = True
+        virement.save()
+        virement.save()
+        self.assertEqual(get_counts(self.owner.id)[VIREMENTS], 0)
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.owner = User.objects.create_user('owner', 'C1', 'password')
+        self.members = [User.objects.create_user(f'member{i}', f'C{i + 2}', 'password') for i in range(2)]
+
+    def test_drain_creates_notifications_and_empties_the_outbox(self):
+        enqueue_notification(self.owner, User.objects.filter(pk__in=[m.pk for m in self.members]), 'hello')
+
+        self.assertEqual(drain_outbox(), 1)
+
+        self.assertEqual(
+            set(Notification.objects.filter(message='hello').values_list('user_destination', flat=True)),
+            {member.pk for member in self.members})
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_failing_event_is_retried_later_without_blocking_others(self):
+        failing = enqueue_notification(self.owner, [self.members[0].pk], 'fails')
+        enqueue_notification(self.owner, [self.members[1].pk], 'works')
+
+        def create(user_source, user_destinations, message, **kwargs):
+            if message == 'fails':
+                raise RuntimeError('push failed')
+            return create_notifications(user_source, user_destinations, message, **kwargs)
+
+        with mock.patch('notifications.outbox.create_notifications', side_effect=create):
+            self.assertEqual(drain_outbox(), 2)
+            # Not due again yet
+            self.assertEqual(drain_outbox(), 0)
+
+        failing.refresh_from_db()
+        self.assertEqual((failing.attempts, failing.last_error), (1, 'push failed'))
+        self.assertGreater(failing.available_at, timezone.now())
+        self.assertEqual(list(Notification.objects.values_list('message', flat=True)), ['works'])
+
+        NotificationEvent.objects.filter(pk=failing.pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(drain_outbox(), 1)
+        self.assertFalse(NotificationEvent.objects.exists())
+
+    def test_event_is_given_up_after_max_attempts(self):
+        event = enqueue_notification(self.owner, [self.members[0].pk], 'hello')
+        NotificationEvent.objects.filter(pk=event.pk).update(attempts=OUTBOX_MAX_ATTEMPTS)
+
+        self.assertEqual(drain_outbox(), 0)
+        self.assertFalse(Notification.objects.exists())
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.owner = User.objects.create_user('owner', 'C1', 'password')
+        self.member = User.objects.create_user('member', 'C2', 'password')
+
+    def test_cleared_notifications_are_purged_in_chunks(self):
+        for i in range(5):
+            create_notification(self.member, self.owner, f'message {i}')
+        kept = create_notification(self.owner, self.member, 'other user')
+        clear_all(self.owner)
+
+        self.assertEqual(purge_cleared(batch_size=2), 5)
+        self.assertEqual(list(Notification.objects.values_list('pk', flat=True)), [kept.pk])
@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import ManageNotificationView
+from .views import ManageNotificationView, CountsView, NotificationStreamView
 
 
 urlpatterns = [
     path('', ManageNotificationView.as_view()),
+    path('counts', CountsView.as_view()),
+    path('stream', NotificationStreamView.as_view()),
     path('<str:notification_id>', ManageNotificationView.as_view()),
 ]
@@ -1,12 +1,230 @@
 # utils.py (or any suitable location)
-from .models import Notification
+import base64
+from collections import Counter
+from datetime import datetime, timedelta
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Q, QuerySet, Sum
+from django.utils import timezone
 
-def create_notification(user_source, user_destination, message):
-    """Create a notification."""
-    notification = Notification.objects.create(
-        user_source=user_source,
-        user_destination=user_destination,
-        message=message,
+from daret.models import Daret
+from users.models import User
+from .counters import NOTIFICATIONS, invalidate_counters, unread_notifications
+from .models import Notification, NotificationReadMark
+from .push import publish_notifications
+
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_PAGE_SIZE = 50
+NOTIFICATION_MAX_PAGE_SIZE = 200
+DIGEST_BATCH_SIZE = 500
+
+
+def create_notification(user_source, user_destination, message='', kind='', daret=None, template=None, params=None):
+    """Create a notification, or merge it into a recent unread one of the same kind and Daret."""
+    user_destination_id = user_destination.pk if isinstance(user_destination, User) else user_destination
+    return create_notifications(
+        user_source, [user_destination_id], message, kind=kind, daret=daret, template=template, params=params)[0]
+
+
+def create_notifications(user_source, user_destinations, message='', kind='', daret=None, template=None,
+                         params=None, batch_size=NOTIFICATION_BATCH_SIZE):
+    """Create the same notification for many users with batched bulk inserts.
+
+    ``user_destinations`` is a User queryset or an iterable of user ids (a
+    ``values_list(..., flat=True)`` queryset works), so recipients are never
+    loaded as model instances. The text is either a free ``message`` or a
+    ``template`` id of ``messages.TEMPLATES`` with its ``params``, stored
+    compactly and rendered when read. With a ``kind``, recipients holding an unread
+    notification of that kind and Daret from within the coalescing window
+    get it replaced by a new row adding up both counts.
+    """
+    if isinstance(user_destinations, QuerySet) and user_destinations.model is User and not user_destinations._fields:
+        user_destinations = user_destinations.values_list('pk', flat=True)
+
+    user_source_id = user_source.pk if isinstance(user_source, User) else user_source
+    daret_id = daret.pk if isinstance(daret, Daret) else daret
+    window = getattr(settings, 'NOTIFICATION_COALESCE_WINDOW', 0)
+
+    if not kind or window <= 0:
+        return insert_notifications([
+            Notification(user_source_id=user_source_id, user_destination_id=user_destination_id,
+                         message=message, template=template, params=params, kind=kind, daret_id=daret_id)
+            for user_destination_id in user_destinations
+        ], batch_size=batch_size)
+
+    events = Counter(user_destinations)
+    now = timezone.now()
+    merged = dict(
+        unread_notifications().filter(
+            kind=kind, daret_id=daret_id, user_destination_id__in=events,
+            created_at__gte=now - timedelta(seconds=window),
+        ).order_by().values('user_destination').annotate(latest=Max('pk')).values_list('user_destination', 'latest')
+    )
+
+    # A merged notification is written again as a new row carrying the total count: ids and
+    # created_at only grow, so clients syncing with ``since`` get it, and what came in between.
+    with transaction.atomic():
+        # Locked and checked unread again: a row merged or read concurrently is left alone
+        previous = dict(
+            unread_notifications().select_for_update(of=('self',)).filter(pk__in=merged.values())
+            .values_list('pk', 'count')
+        )
+        # The new rows refresh the recipients' counters
+        delete_notifications(previous)
+
+        notifications = []
+        for user_destination_id, count in events.items():
+            replaces = merged.get(user_destination_id)
+            if replaces not in previous:
+                replaces = None
+            notification = Notification(
+                user_source_id=user_source_id, user_destination_id=user_destination_id, message=message,
+                template=template, params=params, kind=kind, daret_id=daret_id,
+                count=count + previous.get(replaces, 0))
+            # Pushed along, so streaming clients drop the row it replaces
+            notification.replaces = replaces
+            notifications.append(notification)
+        return insert_notifications(notifications, batch_size=batch_size)
+
+
+def delete_notifications(ids):
+    """Delete notifications by id with a single DELETE and return how many rows went.
+
+    Unlike ``QuerySet.delete()`` no instance is loaded and no signal is sent,
+    so the recipients' counters are left as they are: callers only delete
+    rows that were not counted, or refresh the counters themselves. Nothing
+    references a notification, so there is no cascade to miss.
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    return Notification.objects.filter(pk__in=ids)._raw_delete(Notification.objects.db)
+
+
+def send_notifications(rows, batch_size=NOTIFICATION_BATCH_SIZE):
+    """Create notifications from ``(user_source_id, user_destination_id, template, params)`` rows with batched bulk inserts."""
+    return insert_notifications([
+        Notification(
+            user_source_id=user_source_id,
+            user_destination_id=user_destination_id,
+            template=template,
+            params=params,
+        )
+        for user_source_id, user_destination_id, template, params in rows
+    ], batch_size=batch_size)
+
+
+def insert_notifications(notifications, batch_size=NOTIFICATION_BATCH_SIZE):
+    """Bulk insert notifications, then refresh their recipients' counters and push them."""
+    notifications = Notification.objects.bulk_create(notifications, batch_size=batch_size)
+
+    # bulk_create sends no signals, recount the recipients' unread notifications
+    invalidate_counters(
+        NOTIFICATIONS, [notification.user_destination_id for notification in notifications])
+    publish_notifications(notifications)
+    return notifications
+
+
+def encode_cursor(notification):
+    """Opaque cursor pointing at a notification's (created_at, id) key."""
+    key = f"{notification.created_at.isoformat()}|{notification.pk}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(created_at, id) key of a cursor, raises ValueError when it is malformed."""
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except ValueError as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def older_notifications(queryset, cursor=None, limit=NOTIFICATION_PAGE_SIZE):
+    """One page of notifications, newest first, strictly older than ``cursor``.
+
+    Returns the page and the cursor of the next one, None on the last page.
+    """
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    page = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
+
+
+def newer_notifications(queryset, since, limit=NOTIFICATION_PAGE_SIZE):
+    """Notifications received after the one with id ``since``, oldest first.
+
+    Returns at most ``limit`` of them and whether more are waiting; polling
+    again with the id of the last one returned fetches the rest.
+    """
+    seen = queryset.filter(pk=since).values_list('created_at', flat=True).first()
+    if seen is None:
+        # The last seen notification is gone, ids still grow with time
+        queryset = queryset.filter(id__gt=since)
+    else:
+        queryset = queryset.filter(Q(created_at__gt=seen) | Q(created_at=seen, id__gt=since))
+    page = list(queryset.order_by('created_at', 'id')[:limit + 1])
+    return page[:limit], len(page) > limit
+
+
+def mark_all_read(user):
+    """Mark every notification of a user read by moving their watermark, a single-row write.
+
+    The watermark stops at the newest notification stored, so one created
+    concurrently is not swallowed.
+    """
+    read_until = Notification.objects.filter(user_destination=user).aggregate(
+        read_until=Max('created_at'))['read_until']
+    if read_until is not None:
+        NotificationReadMark.objects.update_or_create(user=user, defaults={'read_until': read_until})
+        invalidate_counters(NOTIFICATIONS, [user.pk])
+    return read_until
+
+
+def get_read_until(user):
+    """Read watermark of a user, None when they never marked all as read."""
+    return NotificationReadMark.objects.filter(user=user).values_list('read_until', flat=True).first()
+
+
+def is_under_read_mark(notification):
+    """Whether a notification is read through its recipient's watermark."""
+    return NotificationReadMark.objects.filter(
+        user_id=notification.user_destination_id, read_until__gte=notification.created_at).exists()
+
+
+def digest_notifications(kinds=None, batch_size=DIGEST_BATCH_SIZE):
+    """Fold every user's unread notifications of the same kind and Daret into the newest one.
+
+    Picks up what coalescing on write left apart: rows older than the
+    window or written by concurrent requests. The kept row adds up the
+    counts of the others, which are deleted. Returns the number of rows
+    removed.
+    """
+    groups = unread_notifications().exclude(kind='')
+    if kinds:
+        groups = groups.filter(kind__in=kinds)
+    groups = list(
+        groups.order_by().values('user_destination', 'kind', 'daret')
+        .annotate(latest=Max('pk'), total=Sum('count'), rows=Count('pk')).filter(rows__gt=1)
     )
-    return notification
+
+    removed = 0
+    for start in range(0, len(groups), batch_size):
+        batch = groups[start:start + batch_size]
+        kept = Notification.objects.filter(pk__in=[group['latest'] for group in batch]).only('pk', 'count')
+        totals = {group['latest']: group['total'] for group in batch}
+        for notification in kept:
+            notification.count = totals[notification.pk]
+        Notification.objects.bulk_update(kept, ['count'])
+
+        folded = Q()
+        for group in batch:
+            # Rows created after the grouping are left for the next run
+            folded |= Q(user_destination=group['user_destination'], kind=group['kind'], daret=group['daret'],
+                        pk__lt=group['latest'])
+        removed += unread_notifications().filter(folded).delete()[0]
+    return removed
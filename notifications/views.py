@@ -1,20 +1,30 @@
 import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import SessionAuthentication
-from rest_framework_simplejwt.authentication import JWTAuthentication
+from authentication.authentication import CachedJWTAuthentication
 from django.shortcuts import get_object_or_404
-from authentication.utils import APIAccessMixin
+from authentication.utils import APIAccessMixin, StreamingListMixin, is_asgi_request
 from users.models import User
+from .counters import NOTIFICATIONS, get_counts
 from .models import Notification
 from .serializers import NotificationSerializer
+from .push import stream_notifications
+from .retention import clear_all
+from .utils import (NOTIFICATION_MAX_PAGE_SIZE, NOTIFICATION_PAGE_SIZE, create_notification, get_read_until,
+                    mark_all_read, newer_notifications, older_notifications)
 
 
-class ManageNotificationView(APIAccessMixin, APIView):
+class ManageNotificationView(APIAccessMixin, StreamingListMixin, APIView):
     """Manage Notifications"""
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
+    stream_lists = True
 
     def post(self, request, *args, **kwargs):
         """Create a new notification"""
@@ -42,7 +52,7 @@ class ManageNotificationView(APIAccessMixin, APIView):
             return Response({'success': False, 'message': 'User destination does not exist.'}, status=404)
 
         # Create the notification
-        notification = Notification.objects.create(
+        notification = create_notification(
             user_source=user_source,
             user_destination=user_destination,  # Store the user instance, not just the ID
             message=message
@@ -51,17 +61,47 @@ class ManageNotificationView(APIAccessMixin, APIView):
         return Response({'success': True, 'message': 'Notification created successfully.'}, status=201)
 
     def get(self, request, *args, **kwargs):
-        """Retrieve all notifications for the logged-in user"""
+        """Retrieve the notifications of the logged-in user
+
+        Without parameters every notification is returned. ``since`` (the id of
+        the last notification seen) returns only newer ones, ``cursor`` or
+        ``limit`` return one page going back in time.
+        """
         user = request.user
-        notifications = Notification.objects.filter(user_destination=user)
+        notifications = Notification.objects.visible().filter(
+            user_destination=user).select_related('user_source', 'user_destination')
+
+        unread_notifications = get_counts(user.id)[NOTIFICATIONS]
+        context = {'read_until': get_read_until(user)}
 
-        serializer = NotificationSerializer(notifications, many=True)
-        unread_notifications = notifications.filter(is_read=False).count()
+        params = request.query_params
+        if not {'since', 'cursor', 'limit'} & set(params):
+            return self.list_response(
+                notifications, NotificationSerializer, serializer_context=context, unread_count=unread_notifications)
 
-        return Response({'success': True, 'data': serializer.data, 'unread_count': unread_notifications})
+        try:
+            limit = min(int(params.get('limit', NOTIFICATION_PAGE_SIZE)), NOTIFICATION_MAX_PAGE_SIZE)
+            if limit < 1:
+                raise ValueError('limit must be positive')
+
+            if 'since' in params:
+                page, has_more = newer_notifications(notifications, int(params['since']), limit)
+                extra = {'since': page[-1].id if page else int(params['since']), 'has_more': has_more}
+            else:
+                page, next_cursor = older_notifications(notifications, params.get('cursor'), limit)
+                extra = {'next_cursor': next_cursor}
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, status=400)
+
+        serializer = NotificationSerializer(page, many=True, context=context)
+        return Response({'success': True, 'data': serializer.data, 'unread_count': unread_notifications, **extra}, status=200)
+
+    def put(self, request, notification_id=None, *args, **kwargs):
+        """Mark a single notification or all notifications of the current user as read"""
+        if not notification_id:
+            mark_all_read(request.user)
+            return Response({'success': True, 'message': 'All notifications marked as read.'}, status=200)
 
-    def put(self, request, notification_id, *args, **kwargs):
-        """Mark a notification as read"""
         # Retrieve the notification
         notification = get_object_or_404(
             Notification, id=notification_id, user_destination=request.user)
@@ -85,7 +125,61 @@ class ManageNotificationView(APIAccessMixin, APIView):
             notification.delete()
             return Response({'success': True, 'message': 'Notification deleted successfully.'}, status=200)
         else:
-            # Case 2: Delete all notifications for the current user
-            deleted_count, _ = Notification.objects.filter(
-                user_destination=user).delete()
-            return Response({'success': True, 'message': f'All {deleted_count} notifications deleted successfully.'}, status=200)
+            # Case 2: Clear all notifications for the current user, purged later in chunks
+            clear_all(user)
+            return Response({'success': True, 'message': 'All notifications deleted successfully.'}, status=202)
+
+
+class CountsView(APIAccessMixin, APIView):
+    """Badge counters"""
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        """Pending virements, join requests and unread notifications of the logged-in user"""
+        return Response({'success': True, 'data': get_counts(request.user.id)}, status=200)
+
+
+class NotificationStreamView(View):
+    """Push notifications to the logged-in user as Server-Sent Events
+
+    Served by the ASGI application, so an idle client holds one open
+    connection instead of polling the list.
+    """
+
+    async def get(self, request, *args, **kwargs):
+        """Stream notifications as they are created, after the ones missed since Last-Event-ID"""
+        if not is_asgi_request(request):
+            # A WSGI server would collect the endless stream before sending it
+            return JsonResponse({'success': False, 'message': 'Streaming needs the ASGI server, poll with since instead.'},
+                                status=501)
+
+        user = await sync_to_async(self.authenticate)(request)
+        if user is None:
+            return JsonResponse({'success': False, 'message': 'Authentication credentials were not provided.'}, status=401)
+
+        backlog = []
+        last_event_id = request.headers.get('Last-Event-ID')
+        if last_event_id and last_event_id.isdigit():
+            backlog = await sync_to_async(self.missed_notifications)(user, int(last_event_id))
+
+        response = StreamingHttpResponse(
+            stream_notifications(user.id, backlog), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    def authenticate(self, request):
+        try:
+            authenticated = CachedJWTAuthentication().authenticate(request)
+        except AuthenticationFailed:
+            return None
+        if authenticated is not None:
+            return authenticated[0]
+        return request.user if request.user.is_authenticated else None
+
+    def missed_notifications(self, user, since):
+        notifications = Notification.objects.visible().filter(
+            user_destination=user).select_related('user_source', 'user_destination')
+        page, _ = newer_notifications(notifications, since, NOTIFICATION_MAX_PAGE_SIZE)
+        return NotificationSerializer(page, many=True, context={'read_until': get_read_until(user)}).data
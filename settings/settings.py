@@ -86,7 +86,9 @@ WSGI_APPLICATION = 'settings.wsgi.application'
 DATABASES = {
     'default': dj_database_url.config(
         default=config('DATABASE_URL'),
-        conn_max_age=600,
+        # Requests run on short-lived ASGI threads, each with its own connection:
+        # persistent ones would pile up, put a pooler such as PgBouncer in front instead
+        conn_max_age=config('CONN_MAX_AGE', default=0, cast=int),
         conn_health_checks=True,
     ) if not DEBUG else {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -141,13 +143,24 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'authentication.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Proxies in front of the app whose X-Forwarded-For entries are trusted, throttles key on
+    # the address they saw; with 0 the client-supplied header is ignored for REMOTE_ADDR
+    'NUM_PROXIES': config('NUM_PROXIES', default=0, cast=int),
+    # Token buckets of authentication.throttling, '<scope>_<ident>': '<burst>/<period>'
+    'DEFAULT_THROTTLE_RATES': {
+        'login_ip': '30/min',
+        'login_username': '5/min',
+        'password_reset_ip': '10/hour',
+        'password_reset_cnie': '5/hour',
+        'refresh_ip': '60/min',
+    },
 }
 
 # JWT authentication settings
@@ -161,7 +174,7 @@ SIMPLE_JWT = {
     'AUTH_HEADER_TYPES': ('Bearer',),
     'USER_ID_FIELD': 'id',
     'USER_ID_CLAIM': 'user_id',
-    'UPDATE_LAST_LOGIN': True,
+    'UPDATE_LAST_LOGIN': False,  # LoginView's auth_login already sets last_login
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
     'JTI_CLAIM': 'jti',
@@ -170,6 +183,14 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
 }
 
+# Unread notifications of the same kind, destination and Daret created within
+# this many seconds are merged into one row, 0 disables coalescing
+NOTIFICATION_COALESCE_WINDOW = config('NOTIFICATION_COALESCE_WINDOW', default=3600, cast=int)
+
+# Notifications older than this many months are dropped by the retention job,
+# a whole monthly partition at a time on PostgreSQL
+NOTIFICATION_RETENTION_MONTHS = config('NOTIFICATION_RETENTION_MONTHS', default=12, cast=int)
+
 
 # """ Django settings for settings project. """
 # from datetime import timedelta
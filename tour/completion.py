@@ -0,0 +1,74 @@
+import threading
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+
+COMPLETION_CHUNK_SIZE = 1000
+
+_dirty = threading.local()
+
+
+def mark_completion_dirty(tour_ids=(), daret_ids=()):
+    """Queue Tours and Darets whose completion must be re-derived.
+
+    Ids are collected per thread and evaluated once when the current
+    transaction commits (immediately in autocommit mode), so saving many
+    rows costs a single recompute per parent.
+    """
+    if not hasattr(_dirty, 'tours'):
+        _dirty.tours, _dirty.darets = set(), set()
+    _dirty.tours.update(tour_ids)
+    _dirty.darets.update(daret_ids)
+
+    # Registered on every call: a rolled back transaction drops its callback,
+    # the ids it left behind are then flushed with the next commit
+    transaction.on_commit(flush_completion)
+
+
+def flush_completion():
+    """Evaluate every queued Tour and Daret."""
+    tour_ids = getattr(_dirty, 'tours', set())
+    daret_ids = getattr(_dirty, 'darets', set())
+    if tour_ids or daret_ids:
+        _dirty.tours, _dirty.darets = set(), set()
+        recompute_completion(tour_ids, daret_ids)
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), COMPLETION_CHUNK_SIZE):
+        yield ids[start:start + COMPLETION_CHUNK_SIZE]
+
+
+def recompute_completion(tour_ids=(), daret_ids=()):
+    """Mark Tours received and Darets done with aggregate queries.
+
+    A Tour is received once it has sent virements and none pending, a Daret
+    is done once it has Tours and all are received. Like the model saves
+    this replaces, flags are only ever switched on.
+    """
+    from daret.models import Daret
+    from .models import Tour, ConfirmVirement
+    from .utils import touch_darets
+
+    daret_ids = set(daret_ids)
+
+    for chunk in _chunks(tour_ids):
+        Tour.objects.filter(pk__in=chunk, is_recu=False).filter(
+            Exists(ConfirmVirement.objects.filter(tour=OuterRef('pk'), is_send=True))
+        ).exclude(
+            Exists(ConfirmVirement.objects.filter(tour=OuterRef('pk'), is_send=False))
+        ).update(is_recu=True)
+
+        daret_ids.update(Tour.objects.filter(
+            pk__in=chunk, is_recu=True).values_list('daret_id', flat=True))
+
+    for chunk in _chunks(daret_ids):
+        Daret.objects.filter(pk__in=chunk, is_done=False).filter(
+            Exists(Tour.objects.filter(daret=OuterRef('pk')))
+        ).exclude(
+            Exists(Tour.objects.filter(daret=OuterRef('pk'), is_recu=False))
+        ).update(is_done=True)
+
+    # Received tours and finished Darets show on the cards
+    touch_darets(daret_ids)
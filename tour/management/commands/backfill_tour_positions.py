@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from tour.utils import backfill_tour_positions
+
+
+class Command(BaseCommand):
+    help = 'Set the position of Tours created before positions existed from their ordre'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebalance every Daret, not only those with Tours at position 0')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of Darets rebalanced per transaction')
+
+    def handle(self, *args, **options):
+        count = backfill_tour_positions(all_darets=options['all'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"{count} Darets rebalanced"))
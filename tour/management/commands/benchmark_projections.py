@@ -0,0 +1,87 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from daret.models import Daret, JoinDaret
+from daret.projections import project_join_darets
+from daret.serializers import JoinDaretSerializer
+from tour.models import Tour, ConfirmVirement
+from tour.projections import project_confirm_virements, project_tours
+from tour.serializers import TourSerializer, ConfirmVirementSerializer
+from users.models import User
+
+USERS_PER_DARET = 100
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare list serializers with values() projections on generated rows (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[1000, 10000, 100000])
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['sizes'])
+        try:
+            with transaction.atomic():
+                self.populate(sizes[-1])
+                self.stdout.write(
+                    f"{'list':<16}{'rows':>8}{'serializer':>14}{'projection':>14}{'speedup':>10}")
+                for size in sizes:
+                    self.compare('Tour', size,
+                                 Tour.objects.select_related('daret__owner', 'user'),
+                                 TourSerializer, Tour.objects, project_tours)
+                    self.compare('ConfirmVirement', size,
+                                 ConfirmVirement.objects.select_related(
+                                     'tour__daret', 'partie_beneficiaire', 'partie_donnenant'),
+                                 ConfirmVirementSerializer, ConfirmVirement.objects, project_confirm_virements)
+                    self.compare('JoinDaret', size,
+                                 JoinDaret.objects.select_related('daret', 'participant'),
+                                 JoinDaretSerializer, JoinDaret.objects, project_join_darets)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def populate(self, rows):
+        """Create ``rows`` Tours, JoinDarets and ConfirmVirements."""
+        users = User.objects.bulk_create([
+            User(username=f'bench_{i}', cnie=f'BENCH{i}', password='!',
+                 first_name='Bench', last_name=str(i), bank_account=f'{i:030d}')
+            for i in range(USERS_PER_DARET)
+        ])
+        darets = Daret.objects.bulk_create([
+            Daret(owner=users[0], name=f'bench {i}', date_start=date(2025, 1, 1),
+                  mensuel=500, nbre_elements=USERS_PER_DARET, codeGroup=f'bench{i}')
+            for i in range(-(-rows // USERS_PER_DARET))
+        ])
+        pairs = [(daret, user) for daret in darets for user in users][:rows]
+
+        JoinDaret.objects.bulk_create(
+            [JoinDaret(daret=daret, participant=user, is_confirmed=True) for daret, user in pairs],
+            batch_size=5000)
+        tours = Tour.objects.bulk_create(
+            [Tour(daret=daret, user=user, date_obtenu=date(2025, 1, 1), ordre='1') for daret, user in pairs],
+            batch_size=5000)
+        ConfirmVirement.objects.bulk_create(
+            [ConfirmVirement(tour=tour, partie_beneficiaire=tour.user, partie_donnenant=users[0])
+             for tour in tours],
+            batch_size=5000)
+
+    def compare(self, label, size, serializer_queryset, serializer_class, projection_queryset, projection):
+        start = time.perf_counter()
+        serializer_class(serializer_queryset.order_by('id')[:size], many=True).data
+        serializer_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        list(projection(projection_queryset.order_by('id')[:size]))
+        projection_time = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{label:<16}{size:>8}{serializer_time:>13.3f}s{projection_time:>13.3f}s"
+            f"{serializer_time / projection_time:>9.1f}x")
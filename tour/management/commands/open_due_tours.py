@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+
+from tour.utils import open_tours_due
+
+
+class Command(BaseCommand):
+    help = 'Create the ConfirmVirement rows of every Tour due in a date range'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            default=None, help='First payout date, today by default')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            default=None, help='Last payout date, one week after --from by default')
+
+    def handle(self, *args, **options):
+        date_from = options['date_from'] or date.today()
+        date_to = options['date_to'] or date_from + timedelta(days=7)
+
+        count = open_tours_due(date_from, date_to)
+        self.stdout.write(self.style.SUCCESS(
+            f"{count} virements sent for Tours due from {date_from} to {date_to}"))
@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from tour.scheduler import SCHEDULER_CHUNK_SIZE, SCHEDULER_WINDOW_DAYS, run_scheduler
+
+
+class Command(BaseCommand):
+    help = 'Open the Tours due soon, flag overdue virements and remind their donors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help='Day of the run, today by default')
+        parser.add_argument('--window', type=int, default=SCHEDULER_WINDOW_DAYS,
+                            help='Number of days ahead whose Tours are opened')
+        parser.add_argument('--chunk-size', type=int, default=SCHEDULER_CHUNK_SIZE,
+                            help='Number of Darets handled per chunk')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes')
+
+    def handle(self, *args, **options):
+        today = options['date'] or date.today()
+        totals = run_scheduler(
+            today, window_days=options['window'], chunk_size=options['chunk_size'], workers=options['workers'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['darets']} Darets scanned: {totals['opened']} virements opened, "
+            f"{totals['due']} due and {totals['overdue']} overdue reminders sent"))
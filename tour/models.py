@@ -1,7 +1,21 @@
 from django.db import models, transaction
 from django.db import models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from daret.models import Daret
 from users.models import User
+from .completion import mark_completion_dirty
+
+
+class TourQuerySet(models.QuerySet):
+    def in_order(self):
+        """Tours in payout order within their Daret."""
+        return self.order_by('daret', 'position', 'id')
+
+    def ranked(self):
+        """Annotate each Tour with its 1-based rank in the payout order of its Daret."""
+        return self.annotate(rank=Window(
+            RowNumber(), partition_by=[F('daret')], order_by=[F('position').asc(), F('id').asc()]))
 
 
 class Tour(models.Model):
@@ -11,18 +25,29 @@ class Tour(models.Model):
         User, on_delete=models.CASCADE, related_name='tours')
     date_obtenu = models.DateField()
     ordre = models.CharField(max_length=3)
+    # Sort key of the payout order, spaced out so a Tour can be placed between two others
+    position = models.BigIntegerField(default=0)
     is_recu = models.BooleanField(default=False)
 
+    objects = TourQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One Tour per participant, also the conflict target of bulk upserts
+            models.UniqueConstraint(
+                fields=['daret', 'user'], name='unique_tour_per_participant'),
+        ]
+        indexes = [
+            models.Index(fields=['daret', 'position'], name='tour_daret_position_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         # Save the instance first
         super().save(*args, **kwargs)
 
-        # If this tour is marked as received, check all tours in the Daret
+        # If this tour is marked as received, the Daret may be done once all its tours are
         if self.is_recu:
-            if not self.daret.tours.filter(is_recu=False).exists():
-                # All tours in the Daret are marked as received, mark the Daret as done
-                self.daret.is_done = True
-                self.daret.save()
+            mark_completion_dirty(daret_ids=[self.daret_id])
 
 
 class ConfirmVirement(models.Model):
@@ -33,16 +58,25 @@ class ConfirmVirement(models.Model):
     partie_donnenant = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name='donnenant_confirm_virements')
     is_send = models.BooleanField(default=False)
+    # Still not sent once the payout date has passed, set by the nightly scheduler
+    is_overdue = models.BooleanField(default=False)
+    # Reminded on the payout day, so a second run that day does not remind again
+    is_reminded = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            # One confirmation per donor and tour, lets bulk generation ignore existing rows
+            models.UniqueConstraint(
+                fields=['tour', 'partie_beneficiaire', 'partie_donnenant'],
+                name='unique_virement_per_donor'),
+        ]
+
     def save(self, *args, **kwargs):
         # Save the instance first
         super().save(*args, **kwargs)
 
-        # If this confirmation is marked as sent, check all confirmations in the tour
+        # If this confirmation is marked as sent, the tour may be received once all its confirmations are
         if self.is_send:
-            if not self.tour.confirm_virements.filter(is_send=False).exists():
-                # All confirmations for this tour are marked as sent, mark the tour as received
-                self.tour.is_recu = True
-                self.tour.save()
+            mark_completion_dirty(tour_ids=[self.tour_id])
@@ -0,0 +1,64 @@
+from django.db.models import F
+
+PROJECTION_CHUNK_SIZE = 2000
+
+
+def project_tours(queryset, chunk_size=PROJECTION_CHUNK_SIZE):
+    """Rows of TourSerializer for read-only lists, from a single values() query.
+
+    ``total`` is computed in SQL; related names come from joins instead of
+    per-row attribute walks. ``ordre`` is the rank of the Tour by position.
+    """
+    rows = queryset.ranked().values(
+        'id', 'daret', 'rank', 'user', 'date_obtenu', 'is_recu',
+        daret_name=F('daret__name'),
+        owner=F('daret__owner__username'),
+        user_name=F('user__username'),
+        user_first_name=F('user__first_name'),
+        user_last_name=F('user__last_name'),
+        bank_account=F('user__bank_account'),
+        total=F('daret__mensuel') * F('daret__nbre_elements'),
+        elements=F('daret__nbre_elements'),
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield {
+            'id': row['id'],
+            'daret': row['daret'],
+            'daret_name': row['daret_name'],
+            'owner': row['owner'],
+            'ordre': str(row['rank']),
+            'user': row['user'],
+            'user_name': row['user_name'],
+            'full_name': f"{row['user_first_name']} {row['user_last_name']}",
+            'date_obtenu': row['date_obtenu'],
+            'bank_account': row['bank_account'],
+            'total': row['total'],
+            'elements': row['elements'],
+            'is_recu': row['is_recu'],
+        }
+
+
+def project_confirm_virements(queryset, chunk_size=PROJECTION_CHUNK_SIZE):
+    """Rows of ConfirmVirementSerializer for read-only lists, from a single values() query."""
+    rows = queryset.values(
+        'id', 'tour', 'partie_beneficiaire', 'partie_donnenant', 'is_send', 'is_overdue',
+        daret_name=F('tour__daret__name'),
+        partie_beneficiaire_username=F('partie_beneficiaire__username'),
+        beneficiaire_first_name=F('partie_beneficiaire__first_name'),
+        beneficiaire_last_name=F('partie_beneficiaire__last_name'),
+        donnenant_first_name=F('partie_donnenant__first_name'),
+        donnenant_last_name=F('partie_donnenant__last_name'),
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield {
+            'id': row['id'],
+            'daret_name': row['daret_name'],
+            'tour': row['tour'],
+            'partie_beneficiaire': row['partie_beneficiaire'],
+            'partie_beneficiaire_username': row['partie_beneficiaire_username'],
+            'partie_beneficiaire_full_name': f"{row['beneficiaire_first_name']} {row['beneficiaire_last_name']}",
+            'partie_donnenant': row['partie_donnenant'],
+            'partie_donnenant_full_name': f"{row['donnenant_first_name']} {row['donnenant_last_name']}",
+            'is_send': row['is_send'],
+            'is_overdue': row['is_overdue'],
+        }
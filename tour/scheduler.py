@@ -0,0 +1,97 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.db import connections, transaction
+from django.db.models import F
+
+from daret.models import Daret
+from notifications.messages import PAYMENT_DUE_TEMPLATE, PAYMENT_OVERDUE_TEMPLATE
+from notifications.utils import send_notifications
+from .models import Tour, ConfirmVirement
+from .utils import open_tours, touch_darets
+
+SCHEDULER_CHUNK_SIZE = 1000
+SCHEDULER_WINDOW_DAYS = 7
+
+
+def active_daret_chunks(chunk_size=SCHEDULER_CHUNK_SIZE):
+    """Ids of the running Darets, in lists of at most ``chunk_size``."""
+    chunk = []
+    for daret_id in Daret.objects.filter(is_done=False).order_by('id').values_list('id', flat=True).iterator(
+            chunk_size=chunk_size):
+        chunk.append(daret_id)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _reminder_rows(virements, template):
+    return [
+        (row['partie_beneficiaire'], row['partie_donnenant'], template,
+         {'daret': row['daret_name'], 'date': row['date_obtenu'].isoformat()})
+        for row in virements
+    ]
+
+
+def run_chunk(daret_ids, today, window_days=SCHEDULER_WINDOW_DAYS):
+    """Daily pass over a chunk of Darets, in a fixed number of queries.
+
+    Opens every unpaid Tour paid out by the end of the window, catching up
+    the ones a missed run skipped, flags the virements still not sent after
+    their payout date and reminds their donors: once on the payout day and
+    once when the virement becomes overdue. Each reminder is flagged on its
+    virement, so running the pass again sends none twice.
+    """
+    tours = Tour.objects.filter(
+        daret_id__in=daret_ids, is_recu=False,
+        date_obtenu__lte=today + timedelta(days=window_days),
+    ).only('id', 'daret_id', 'user_id')
+    opened = open_tours(tours)
+
+    pending = ConfirmVirement.objects.filter(tour__daret_id__in=daret_ids, is_send=False).values(
+        'id', 'partie_beneficiaire', 'partie_donnenant',
+        daret_id=F('tour__daret_id'), daret_name=F('tour__daret__name'), date_obtenu=F('tour__date_obtenu'),
+    )
+    # The flags and the reminders they record are committed together
+    with transaction.atomic():
+        due = list(pending.filter(tour__date_obtenu=today, is_reminded=False).select_for_update(of=('self',)))
+        overdue = list(pending.filter(
+            tour__date_obtenu__lt=today, is_overdue=False).select_for_update(of=('self',)))
+        if due:
+            ConfirmVirement.objects.filter(id__in=[row['id'] for row in due]).update(is_reminded=True)
+        if overdue:
+            ConfirmVirement.objects.filter(id__in=[row['id'] for row in overdue]).update(is_overdue=True)
+            touch_darets({row['daret_id'] for row in overdue})
+
+        send_notifications(
+            _reminder_rows(due, PAYMENT_DUE_TEMPLATE)
+            + _reminder_rows(overdue, PAYMENT_OVERDUE_TEMPLATE)
+        )
+    return {'darets': len(daret_ids), 'opened': opened, 'due': len(due), 'overdue': len(overdue)}
+
+
+def run_scheduler(today, window_days=SCHEDULER_WINDOW_DAYS, chunk_size=SCHEDULER_CHUNK_SIZE, workers=1):
+    """Run the daily pass over every running Daret and return the totals.
+
+    With more than one worker the chunks are spread over a pool of forked
+    processes, each opening its own database connection.
+    """
+    chunks = list(active_daret_chunks(chunk_size))
+    totals = {'darets': 0, 'opened': 0, 'due': 0, 'overdue': 0}
+
+    if workers > 1 and len(chunks) > 1:
+        # Forked workers must not share the parent's connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            results = pool.map(run_chunk, chunks, [today] * len(chunks), [window_days] * len(chunks))
+            results = list(results)
+    else:
+        results = [run_chunk(chunk, today, window_days) for chunk in chunks]
+
+    for result in results:
+        for key, value in result.items():
+            totals[key] += value
+    return totals
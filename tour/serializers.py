@@ -32,6 +32,15 @@ class TourSerializer(serializers.ModelSerializer):
             'elements',
             'is_recu',
         ]
+        # Follows the position, Tours are moved with move_tour
+        read_only_fields = ['ordre']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Ranked querysets give the live payout order
+        if getattr(instance, 'rank', None) is not None:
+            data['ordre'] = str(instance.rank)
+        return data
 
     def get_user_name(self, obj):
         """Get the username of the user."""
@@ -62,6 +71,14 @@ class TourSerializer(serializers.ModelSerializer):
         return None
 
 
+class TourUpsertSerializer(serializers.Serializer):
+    """Participant entry of a bulk Tour upsert, validated without queries."""
+    daret = serializers.IntegerField()
+    user = serializers.IntegerField()
+    date_obtenu = serializers.DateField()
+    order = serializers.IntegerField(min_value=1, max_value=999)
+
+
 class ConfirmVirementSerializer(serializers.ModelSerializer):
     partie_beneficiaire_username = serializers.CharField(
         source='partie_beneficiaire.username', read_only=True
@@ -85,7 +102,9 @@ class ConfirmVirementSerializer(serializers.ModelSerializer):
             'partie_donnenant',
             'partie_donnenant_full_name',
             'is_send',
+            'is_overdue',
         ]
+        read_only_fields = ['is_overdue']
 
     def get_partie_donnenant_full_name(self, obj):
         """Get full name for partie_donnenant."""
@@ -0,0 +1,25 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from daret.models import Daret, JoinDaret
+from .models import Tour, ConfirmVirement
+from .utils import touch_darets
+
+
+@receiver([post_save, post_delete], sender=Daret)
+@receiver([post_save, post_delete], sender=JoinDaret)
+@receiver([post_save, post_delete], sender=Tour)
+def daret_card_changed(sender, instance, **kwargs):
+    """Invalidate the cards showing this Daret."""
+    touch_darets([instance.pk if sender is Daret else instance.daret_id])
+
+
+@receiver([post_save, post_delete], sender=ConfirmVirement)
+def virement_card_changed(sender, instance, **kwargs):
+    """Invalidate the cards showing the Daret of this virement."""
+    if ConfirmVirement.tour.is_cached(instance):
+        daret_ids = [instance.tour.daret_id]
+    else:
+        daret_ids = Tour.objects.filter(
+            pk=instance.tour_id).values_list('daret_id', flat=True)
+    touch_darets(daret_ids)
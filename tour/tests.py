@@ -1,3 +1,192 @@
+from datetime import date
+
 from django.test import TestCase
+from django_redis import get_redis_connection
+from rest_framework.test import APIClient
+
+from daret.models import Daret, JoinDaret
+from users.models import User
+from .models import ConfirmVirement, Tour
+from .scheduler import run_chunk
+from .utils import generate_schedule, move_tour, move_tour_to, open_tours
+
+
+class ScheduleTestCase(TestCase):
+    def setUp(self):
+        get_redis_connection('default').flushdb()
+        self.users = [User.objects.create_user(f'user{i}', f'C{i}', 'password') for i in range(4)]
+        self.daret = Daret.objects.create(
+            owner=self.users[0], name='Daret', date_start=date(2025, 1, 31), mensuel=100, codeGroup='CODE')
+        self.daret.refresh_from_db()
+        for user in self.users:
+            JoinDaret.objects.create(daret=self.daret, participant=user, is_confirmed=True)
+
+    def tour(self, user):
+        return Tour.objects.get(daret=self.daret, user=user)
+
+    def assertScheduleAgrees(self):
+        """Rank, ordre and month agree for every Tour."""
+        for rank, tour in enumerate(Tour.objects.filter(daret=self.daret).in_order()):
+            self.assertEqual(
+                (tour.ordre, tour.date_obtenu.month), (str(rank + 1), rank + 1), f'Tour of {tour.user}')
+
+
+class GenerateScheduleTests(ScheduleTestCase):
+    def test_members_are_scheduled_in_joining_order(self):
+        generate_schedule(self.daret)
+
+        self.assertEqual(
+            [tour.user for tour in Tour.objects.filter(daret=self.daret).in_order()], self.users)
+        self.assertEqual(self.tour(self.users[1]).date_obtenu, date(2025, 2, 28))
+        self.assertScheduleAgrees()
+
+    def test_paid_tours_are_left_as_they_are(self):
+        generate_schedule(self.daret)
+        Tour.objects.filter(user=self.users[1]).update(is_recu=True)
+        paid = self.tour(self.users[1])
+
+        JoinDaret.objects.filter(participant=self.users[0]).delete()
+        generate_schedule(self.daret)
+
+        self.assertFalse(Tour.objects.filter(user=self.users[0]).exists())
+        kept = self.tour(self.users[1])
+        self.assertEqual((kept.date_obtenu, kept.ordre, kept.position), (paid.date_obtenu, paid.ordre, paid.position))
+        # The unpaid Tours fill the month freed before it, then the months after
+        self.assertEqual(
+            [(tour.user, tour.ordre) for tour in Tour.objects.filter(daret=self.daret).in_order()],
+            [(self.users[2], '1'), (self.users[1], '2'), (self.users[3], '3')])
+
+    def test_tours_holding_virements_stay_after_leaving(self):
+        generate_schedule(self.daret)
+        holder = self.tour(self.users[0])
+        ConfirmVirement.objects.create(
+            tour=holder, partie_beneficiaire=self.users[0], partie_donnenant=self.users[1])
+
+        JoinDaret.objects.filter(participant=self.users[0]).delete()
+        generate_schedule(self.daret)
+
+        kept = self.tour(self.users[0])
+        self.assertEqual((kept.date_obtenu, kept.ordre, kept.position), (holder.date_obtenu, holder.ordre, holder.position))
+        self.assertScheduleAgrees()
+
+
+class MoveTourTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        generate_schedule(self.daret)
+
+    def order(self):
+        return [tour.user for tour in Tour.objects.filter(daret=self.daret).in_order()]
+
+    def test_moved_tour_takes_the_date_of_its_new_slot(self):
+        last = self.tour(self.users[3])
+
+        move_tour(last, self.tour(self.users[0]))
+
+        self.assertEqual(self.order(), [self.users[3]] + self.users[:3])
+        self.assertEqual((last.ordre, last.date_obtenu), ('1', date(2025, 1, 31)))
+        self.assertScheduleAgrees()
+
+    def test_move_to_rank(self):
+        move_tour_to(self.tour(self.users[0]), 3)
+
+        self.assertEqual(self.order(), [self.users[1], self.users[2], self.users[0], self.users[3]])
+        self.assertScheduleAgrees()
+
+    def test_positions_are_respaced_when_the_gap_is_used_up(self):
+        for index, user in enumerate(self.users):
+            Tour.objects.filter(user=user).update(position=index)
+
+        move_tour(self.tour(self.users[3]), self.tour(self.users[1]))
+
+        self.assertEqual(self.order(), [self.users[0], self.users[3], self.users[1], self.users[2]])
+        self.assertScheduleAgrees()
+
+    def test_unpaid_tour_moves_around_paid_ones(self):
+        Tour.objects.filter(user=self.users[0]).update(is_recu=True)
+
+        with self.assertRaises(ValueError):
+            move_tour(self.tour(self.users[0]), self.tour(self.users[3]), after=True)
+        move_tour(self.tour(self.users[3]), self.tour(self.users[0]))
+
+        # The first month is paid out, the moved Tour takes the next one
+        self.assertEqual(self.order(), [self.users[0], self.users[3], self.users[1], self.users[2]])
+        self.assertScheduleAgrees()
+
+
+class OpenToursTests(ScheduleTestCase):
+    def test_only_donors_without_a_virement_are_counted(self):
+        tour = generate_schedule(self.daret)[0]
+
+        self.assertEqual(open_tours([tour]), 3)
+        JoinDaret.objects.create(
+            daret=self.daret, participant=User.objects.create_user('late', 'C9', 'password'), is_confirmed=True)
+        self.assertEqual(open_tours([tour]), 1)
+        self.assertEqual(open_tours([tour]), 0)
+        self.assertEqual(ConfirmVirement.objects.filter(tour=tour).count(), 4)
+
+
+class SchedulerTests(ScheduleTestCase):
+    def test_tours_missed_by_earlier_runs_are_opened(self):
+        schedule = generate_schedule(self.daret)
+
+        run_chunk([self.daret.id], date(2025, 3, 29), window_days=3)
+
+        self.assertEqual(
+            [ConfirmVirement.objects.filter(tour=tour).count() for tour in schedule], [3, 3, 3, 0])
+
+
+class CompletionTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        open_tours(generate_schedule(self.daret))
+
+    def send_virements(self, tour):
+        for virement in ConfirmVirement.objects.filter(tour=tour):
+            virement.is_send = True
+            virement.save()
+
+    def test_tour_is_received_when_the_transaction_commits(self):
+        tour = self.tour(self.users[0])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.send_virements(tour)
+            tour.refresh_from_db()
+            self.assertFalse(tour.is_recu)
+
+        tour.refresh_from_db()
+        self.assertTrue(tour.is_recu)
+        self.daret.refresh_from_db()
+        self.assertFalse(self.daret.is_done)
+
+    def test_daret_is_done_once_every_tour_is_received(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for tour in Tour.objects.filter(daret=self.daret):
+                self.send_virements(tour)
+
+        self.assertFalse(Tour.objects.filter(daret=self.daret, is_recu=False).exists())
+        self.daret.refresh_from_db()
+        self.assertTrue(self.daret.is_done)
+
+
+class ConfirmVirementsTests(ScheduleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tour_of_owner = generate_schedule(self.daret)[0]
+        open_tours([self.tour_of_owner])
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def test_confirms_every_listed_virement(self):
+        ids = list(ConfirmVirement.objects.filter(tour=self.tour_of_owner).values_list('id', flat=True))
+
+        response = self.client.put('/api/v1/tour/confirm-virements', {'ids': ids}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(ConfirmVirement.objects.filter(pk__in=ids, is_send=False).exists())
+
+    def test_body_must_be_an_object(self):
+        response = self.client.put('/api/v1/tour/confirm-virements', [1, 2], format='json')
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data, {'success': False, 'message': 'Invalid JSON data'})
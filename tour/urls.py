@@ -1,10 +1,13 @@
 from django.urls import path
-from .views import ManageTourView, ManageConfirmVirementView, CardTourView
+from .views import ManageTourView, ScheduleTourView, OpenTourView, MoveTourView, ManageConfirmVirementView, CardTourView
 
 
 urlpatterns = [
     path('', ManageTourView.as_view()),
     path('<int:id_tour>', ManageTourView.as_view()),
+    path('schedule/<int:id_daret>', ScheduleTourView.as_view()),
+    path('open/<int:id_tour>', OpenTourView.as_view()),
+    path('move/<int:id_tour>', MoveTourView.as_view()),
     path('card', CardTourView.as_view()),
     path('confirm-virements', ManageConfirmVirementView.as_view()),
     path('confirm-virements/<int:id_confirm_virement>',
@@ -0,0 +1,376 @@
+import calendar
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch
+
+from daret.models import Daret, JoinDaret
+from daret.utils import ROLE_PENDING, get_membership, reconcile_participant_counts
+from notifications.counters import VIREMENTS, invalidate_counters
+from .models import Tour, ConfirmVirement
+from .serializers import TourSerializer, ConfirmVirementSerializer
+
+POSITION_GAP = 1024
+CARD_CACHE_TIMEOUT = 60 * 5
+VIREMENT_BATCH_SIZE = 1000
+CARD_VERSION_TIMEOUT = 60 * 60 * 24
+
+
+def add_months(day, months):
+    """Shift a date by whole months, clamping the day to the end of the month."""
+    month = day.month - 1 + months
+    year = day.year + month // 12
+    month = month % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _ordre_key(tour):
+    # Tours created before positions existed all sit at 0 and keep their ordre
+    try:
+        ordre = int(tour.ordre)
+    except (TypeError, ValueError):
+        ordre = float('inf')
+    return (tour.position, ordre, tour.id)
+
+
+def _month_offset(start, day):
+    return (day.year - start.year) * 12 + day.month - start.month
+
+
+def _run_positions(months, low, high):
+    """Positions of consecutive unpaid Tours paid in ``months``, strictly between ``low`` and ``high``."""
+    wanted = [(month + 1) * POSITION_GAP for month in months]
+    if not wanted or ((low is None or wanted[0] > low) and (high is None or wanted[-1] < high)):
+        return wanted
+    if low is None:
+        return [high - (len(months) - index) * POSITION_GAP for index in range(len(months))]
+    if high is None:
+        return [low + (index + 1) * POSITION_GAP for index in range(len(months))]
+    step = (high - low) // (len(months) + 1)
+    if step < 1:
+        raise ValueError('No room left between the paid Tours')
+    return [low + (index + 1) * step for index in range(len(months))]
+
+
+def _place_unpaid(daret, fixed, unpaid):
+    """Give the unpaid Tours the months the fixed Tours leave free, in order.
+
+    ``fixed`` Tours, paid out or holding virements, are left as they are.
+    The ``unpaid`` ones, in payout order, take the free months from
+    ``date_start`` on, with the matching ``ordre`` and a position between
+    the fixed Tours around them. Returns every Tour in payout order and the
+    saved unpaid Tours that changed.
+    """
+    taken = {_month_offset(daret.date_start, tour.date_obtenu) for tour in fixed}
+    slots = []
+    month = 0
+    for tour in unpaid:
+        while month in taken:
+            month += 1
+        slots.append((month, tour))
+        month += 1
+    slots += [(_month_offset(daret.date_start, tour.date_obtenu), tour) for tour in fixed]
+    slots.sort(key=lambda slot: (slot[0], _ordre_key(slot[1])))
+
+    fixed_ids = {tour.pk for tour in fixed}
+    changed = []
+    run = []
+    low = None
+    for month, tour in slots + [(None, None)]:
+        if tour is not None and tour.pk not in fixed_ids:
+            run.append((month, tour))
+            continue
+
+        high = tour.position if tour is not None else None
+        for (run_month, run_tour), position in zip(run, _run_positions([m for m, _ in run], low, high)):
+            date_obtenu = add_months(daret.date_start, run_month)
+            ordre = str(run_month + 1)
+            if (run_tour.date_obtenu, run_tour.ordre, run_tour.position) != (date_obtenu, ordre, position):
+                run_tour.date_obtenu = date_obtenu
+                run_tour.ordre = ordre
+                run_tour.position = position
+                if run_tour.pk is not None:
+                    changed.append(run_tour)
+        run = []
+        low = high
+
+    return [tour for _, tour in slots], changed
+
+
+@transaction.atomic
+def generate_schedule(daret):
+    """Create or realign the Tours of a Daret, one per confirmed participant.
+
+    Members already scheduled keep their relative order and newcomers are
+    appended in the order they joined. The n-th month after ``date_start``
+    goes to the n-th Tour. Tours paid out or holding virements are never
+    rewritten: they keep their month and the unpaid Tours are dated around
+    them. Tours of users who are no longer members are removed, unless they
+    were paid out or hold virements. Runs in a fixed number of queries
+    whatever the Daret size and returns the Tours in payout order.
+    """
+    if not isinstance(daret, Daret):
+        daret = Daret.objects.get(pk=daret)
+
+    members = list(
+        JoinDaret.objects.filter(daret=daret, is_confirmed=True)
+        .order_by('created_at', 'id').values_list('participant_id', flat=True)
+    )
+    tours = {
+        tour.user_id: tour
+        for tour in Tour.objects.select_for_update().filter(daret=daret).annotate(
+            has_virements=Exists(ConfirmVirement.objects.filter(tour=OuterRef('pk'))))
+    }
+
+    member_ids = set(members)
+    fixed = [tour for tour in tours.values() if tour.is_recu or tour.has_virements]
+    fixed_ids = {tour.pk for tour in fixed}
+    unpaid = [tour for user_id, tour in tours.items() if user_id in member_ids and tour.pk not in fixed_ids]
+    kept = fixed_ids | {tour.pk for tour in unpaid}
+    Tour.objects.filter(pk__in=[tour.pk for tour in tours.values() if tour.pk not in kept]).delete()
+
+    unpaid.sort(key=_ordre_key)
+    unpaid += [Tour(daret=daret, user_id=user_id) for user_id in members if user_id not in tours]
+    schedule, changed = _place_unpaid(daret, fixed, unpaid)
+
+    Tour.objects.bulk_update(changed, ['date_obtenu', 'ordre', 'position'])
+    Tour.objects.bulk_create([tour for tour in schedule if tour.pk is None])
+    touch_darets([daret.id])
+
+    return schedule
+
+
+@transaction.atomic
+def upsert_tours(tours_data):
+    """Create or update Tours keyed on (daret, user) with a single statement.
+
+    ``tours_data`` holds dicts with ``daret`` and ``user`` ids, ``date_obtenu``
+    and ``order``; a later entry for the same pair wins. The participant
+    count of every touched Daret is recomputed in the same transaction.
+    """
+    tours = {
+        (tour['daret'], tour['user']): Tour(
+            daret_id=tour['daret'],
+            user_id=tour['user'],
+            date_obtenu=tour['date_obtenu'],
+            ordre=str(tour['order']),
+            position=tour['order'] * POSITION_GAP,
+        )
+        for tour in tours_data
+    }
+    Tour.objects.bulk_create(
+        list(tours.values()),
+        update_conflicts=True,
+        unique_fields=['daret', 'user'],
+        update_fields=['date_obtenu', 'ordre', 'position'],
+    )
+    reconcile_participant_counts({daret_id for daret_id, _ in tours})
+    touch_darets({daret_id for daret_id, _ in tours})
+    return list(tours.values())
+
+
+def rebalance_tours(daret_id):
+    """Spread the positions of a Daret's Tours evenly again, keeping their order."""
+    tours = sorted(Tour.objects.filter(daret_id=daret_id), key=_ordre_key)
+    for index, tour in enumerate(tours):
+        tour.position = (index + 1) * POSITION_GAP
+        tour.ordre = str(index + 1)
+    Tour.objects.bulk_update(tours, ['position', 'ordre'])
+    return {tour.id: tour.position for tour in tours}
+
+
+def backfill_tour_positions(all_darets=False, chunk_size=1000):
+    """Rebalance the Darets holding Tours created before positions existed.
+
+    Their Tours all sit at position 0, so every ordering falls back to its
+    own tie-break; rebalancing sets positions from ``ordre`` once. With
+    ``all_darets`` every Daret with Tours is rebalanced. Returns the number
+    of Darets rebalanced.
+    """
+    tours = Tour.objects.all() if all_darets else Tour.objects.filter(position=0)
+    daret_ids = list(tours.order_by('daret_id').values_list('daret_id', flat=True).distinct())
+    for start in range(0, len(daret_ids), chunk_size):
+        chunk = daret_ids[start:start + chunk_size]
+        with transaction.atomic():
+            for daret_id in chunk:
+                rebalance_tours(daret_id)
+            touch_darets(chunk)
+    return len(daret_ids)
+
+
+@transaction.atomic
+def move_tour(tour, target, after=False):
+    """Move a Tour right before (or after) another Tour of the same Daret.
+
+    The Tour takes a position between the target and its neighbour, then
+    the schedule is realigned so ``date_obtenu`` and ``ordre`` follow the
+    new order. Tours paid out or holding virements keep their month and
+    cannot be moved; an unpaid Tour moved next to one of them takes the
+    closest free month.
+    """
+    if tour.is_recu or ConfirmVirement.objects.filter(tour=tour).exists():
+        raise ValueError('A Tour paid out or holding virements cannot be moved')
+
+    for attempt in range(2):
+        siblings = Tour.objects.filter(daret_id=target.daret_id).exclude(pk=tour.pk)
+        if after:
+            neighbour = siblings.filter(position__gt=target.position).order_by('position').values_list(
+                'position', flat=True).first()
+            low, high = target.position, neighbour
+        else:
+            neighbour = siblings.filter(position__lt=target.position).order_by('-position').values_list(
+                'position', flat=True).first()
+            low, high = neighbour, target.position
+
+        if low is None:
+            position = high - POSITION_GAP
+        elif high is None:
+            position = low + POSITION_GAP
+        elif high - low > 1:
+            position = (low + high) // 2
+        elif attempt == 0:
+            # Realigning spaces the unpaid Tours out again
+            generate_schedule(target.daret_id)
+            target.refresh_from_db(fields=['position'])
+            continue
+        else:
+            raise ValueError('No room left to move the Tour')
+
+        Tour.objects.filter(pk=tour.pk).update(position=position)
+        moved = next(t for t in generate_schedule(target.daret_id) if t.pk == tour.pk)
+        tour.date_obtenu, tour.ordre, tour.position = moved.date_obtenu, moved.ordre, moved.position
+        return tour
+
+
+def move_tour_to(tour, ordre):
+    """Move a Tour to the 1-based rank ``ordre`` in the payout order of its Daret."""
+    siblings = list(Tour.objects.filter(daret_id=tour.daret_id).exclude(pk=tour.pk).in_order())
+    if not siblings:
+        return tour
+    if ordre <= len(siblings):
+        return move_tour(tour, siblings[max(ordre, 1) - 1])
+    return move_tour(tour, siblings[-1], after=True)
+
+
+def card_version_key(daret_id):
+    return f"daret_{daret_id}_card_version"
+
+
+def touch_darets(daret_ids):
+    """Invalidate every cached card that shows one of these Darets, now and once the change is committed."""
+    daret_ids = set(daret_ids)
+
+    def touch():
+        for daret_id in daret_ids:
+            key = card_version_key(daret_id)
+            cache.add(key, 0, timeout=CARD_VERSION_TIMEOUT)
+            cache.incr(key)
+
+    touch()
+    # A card built from the old rows before the commit would be cached under the new version
+    transaction.on_commit(touch)
+
+
+def card_cache_key(user):
+    """Cache key of a user's card, derived from the versions of their Darets.
+
+    Any change to a Daret, its Tours, virements or members bumps its version
+    and joining or leaving a Daret changes the membership index, so a stale
+    card is never looked up again.
+    """
+    daret_ids = sorted(
+        daret_id for daret_id, role in get_membership(user.id).items() if role != ROLE_PENDING)
+    versions = cache.get_many([card_version_key(daret_id) for daret_id in daret_ids])
+    signature = ','.join(
+        f"{daret_id}:{versions.get(card_version_key(daret_id), 0)}" for daret_id in daret_ids)
+    return f"user_{user.id}_card_{hashlib.md5(signature.encode()).hexdigest()}"
+
+
+def build_card(user):
+    """Tours and the user's virements of every running Daret they take part in, in three queries."""
+    darets = Daret.objects.filter(
+        Exists(JoinDaret.objects.filter(daret=OuterRef('pk'), participant=user, is_confirmed=True)),
+        is_done=False,
+    ).select_related('owner').prefetch_related(
+        Prefetch('tours', queryset=Tour.objects.ranked().select_related('user').order_by('position', 'id')),
+        Prefetch(
+            'tours__confirm_virements',
+            queryset=ConfirmVirement.objects.filter(partie_donnenant=user).select_related(
+                'partie_beneficiaire', 'partie_donnenant'),
+            to_attr='user_virements',
+        ),
+    )
+
+    combined_data = []
+    for daret in darets:
+        tours = daret.tours.all()
+        combined_data.append({
+            'tours': TourSerializer(tours, many=True).data,
+            'virements': [
+                virement
+                for tour in tours
+                for virement in ConfirmVirementSerializer(tour.user_virements, many=True).data
+            ],
+        })
+    return combined_data
+
+
+def get_card(user):
+    """Card data of a user, served from the cache when nothing changed."""
+    cache_key = card_cache_key(user)
+    card = cache.get(cache_key)
+
+    if card is None:
+        card = build_card(user)
+        cache.set(cache_key, card, timeout=CARD_CACHE_TIMEOUT)
+
+    return card
+
+
+def open_tours(tours):
+    """Create the missing ConfirmVirement rows of the given Tours.
+
+    Every confirmed member of the Daret other than the beneficiary owes the
+    beneficiary a virement. Donors that already have one are skipped, the
+    others are written with one batched bulk_create that still ignores rows
+    inserted concurrently. Returns the number of donors that had none.
+    """
+    tours = list(tours)
+    members = {}
+    for daret_id, participant_id in JoinDaret.objects.filter(
+            daret_id__in={tour.daret_id for tour in tours}, is_confirmed=True
+    ).values_list('daret_id', 'participant_id'):
+        members.setdefault(daret_id, []).append(participant_id)
+
+    tour_ids = [tour.id for tour in tours]
+    existing = set()
+    for start in range(0, len(tour_ids), VIREMENT_BATCH_SIZE):
+        existing.update(ConfirmVirement.objects.filter(
+            tour_id__in=tour_ids[start:start + VIREMENT_BATCH_SIZE]
+        ).values_list('tour_id', 'partie_donnenant_id'))
+
+    virements = [
+        ConfirmVirement(
+            tour_id=tour.id,
+            partie_beneficiaire_id=tour.user_id,
+            partie_donnenant_id=participant_id,
+        )
+        for tour in tours
+        for participant_id in members.get(tour.daret_id, [])
+        if participant_id != tour.user_id and (tour.id, participant_id) not in existing
+    ]
+    ConfirmVirement.objects.bulk_create(
+        virements, batch_size=VIREMENT_BATCH_SIZE, ignore_conflicts=True)
+    touch_darets({tour.daret_id for tour in tours})
+    invalidate_counters(VIREMENTS, {tour.user_id for tour in tours})
+
+    return len(virements)
+
+
+def open_tours_due(date_from, date_to):
+    """Open every Tour not yet received whose payout falls between two dates (inclusive)."""
+    tours = Tour.objects.filter(
+        date_obtenu__range=(date_from, date_to), is_recu=False
+    ).only('id', 'daret_id', 'user_id')
+    return open_tours(tours)
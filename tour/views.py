@@ -1,24 +1,37 @@
-from django.db.models import Q
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authentication import SessionAuthentication
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from authentication.utils import APIAccessMixin
+from authentication.authentication import CachedJWTAuthentication
+from authentication.utils import APIAccessMixin, StreamingListMixin
+from .completion import mark_completion_dirty
 from .models import Tour, ConfirmVirement
-from .serializers import TourSerializer, ConfirmVirementSerializer
+from .projections import project_confirm_virements, project_tours
+from .serializers import TourSerializer, TourUpsertSerializer, ConfirmVirementSerializer
+from .utils import generate_schedule, get_card, move_tour, move_tour_to, open_tours, touch_darets, upsert_tours
 from daret.models import Daret, JoinDaret
-from daret.serializers import DaretSerializer, JoinDaretSerializer
+from daret.permissions import HasDaretRole, MEMBER_ROLES, OWNER_ROLES
+from daret.utils import ROLE_OWNER, get_daret_role
+from daret.projections import project_join_darets
 from users.models import User
-from notifications.utils import create_notification
+from notifications.counters import VIREMENTS, invalidate_counters
+from notifications.messages import VIREMENT_RECEIVED_TEMPLATE
+from notifications.models import VIREMENT_RECEIVED
+from notifications.outbox import enqueue_notification
 import json
 
 
-class ManageTourView(APIAccessMixin, APIView):
+class ManageTourView(APIAccessMixin, StreamingListMixin, APIView):
     """Manage Tour in a Daret"""
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
-    permission_classes = [IsAuthenticated]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, HasDaretRole]
+    stream_lists = True
+    # GET takes a Daret id, PUT and DELETE a Tour id
+    daret_url_kwarg = 'id_tour'
+    daret_roles = {'GET': MEMBER_ROLES}
 
     def get(self, request, id_tour=None, *args, **kwargs):
         """Retrieve one or multiple Tour records"""
@@ -29,16 +42,15 @@ class ManageTourView(APIAccessMixin, APIView):
                 # Get all JoinDaret instances related to the Daret
                 participants = JoinDaret.objects.filter(
                     daret=daret_instance, is_confirmed=True)
-                # Serialize the participants
-                serialized_participants = JoinDaretSerializer(
-                    participants, many=True)
-                return Response({'success': True, 'data': serialized_participants.data}, status=200)
+                # Project the participants
+                serialized_participants = list(
+                    project_join_darets(participants))
+                return Response({'success': True, 'data': serialized_participants}, status=200)
             else:
                 # Get all Tour instances
-                daret_tours = Tour.objects.all()
-                # Serialize the tours
-                serialized_daret_tours = TourSerializer(daret_tours, many=True)
-                return Response({'success': True, 'data': serialized_daret_tours.data}, status=200)
+                daret_tours = Tour.objects.order_by('id')
+                # Project the tours
+                return self.list_response(daret_tours, projection=project_tours)
         except Tour.DoesNotExist:
             return Response({'success': False, 'message': 'Tour not found'}, status=404)
         except Exception as e:
@@ -53,47 +65,28 @@ class ManageTourView(APIAccessMixin, APIView):
             if not participants_data:
                 return Response({'success': False, 'message': 'No participants data provided'}, status=400)
 
-            for participant in participants_data:
-                daret_id = participant.get('daret')
-                user_id = participant.get('user')
-                date_tour = participant.get('date_obtenu')
-                ordre = participant.get('order')
-
-                if not (daret_id and user_id and date_tour and ordre):
-                    return Response({'success': False, 'message': 'Missing participant data'}, status=400)
-
-                try:
-                    daret_instance = Daret.objects.get(id=daret_id)
-                    user_instance = User.objects.get(id=user_id)
-                except (Daret.DoesNotExist, User.DoesNotExist) as e:
-                    return Response({'success': False, 'message': str(e)}, status=404)
-
-                # Check for existing Tour record
-                existing_tour = Tour.objects.filter(
-                    daret=daret_instance, user=user_instance).first()
-
-                if existing_tour:
-                    existing_tour.date_obtenu = date_tour
-                    existing_tour.ordre = ordre
-                    existing_tour.save()
-                else:
-                    # Create new Tour
-                    tour_data = {
-                        'daret': daret_instance.id,
-                        'user': user_instance.id,
-                        'date_obtenu': date_tour,
-                        'ordre': ordre,
-                        'is_recu': False,
-                    }
-                    serializer = TourSerializer(data=tour_data)
-                    if serializer.is_valid():
-                        serializer.save()
-                    else:
-                        return Response({'success': False, 'message': serializer.errors}, status=400)
-
-            # Update the Daret's participant count
-            daret_instance.nbre_elements = len(participants_data)
-            daret_instance.save()
+            if any(not (participant.get('daret') and participant.get('user') and participant.get('date_obtenu') and participant.get('order'))
+                   for participant in participants_data):
+                return Response({'success': False, 'message': 'Missing participant data'}, status=400)
+
+            serializer = TourUpsertSerializer(data=participants_data, many=True)
+            if not serializer.is_valid():
+                return Response({'success': False, 'message': serializer.errors}, status=400)
+            tours_data = serializer.validated_data
+
+            # Validate every Daret and User id with one query each
+            daret_ids = {tour['daret'] for tour in tours_data}
+            user_ids = {tour['user'] for tour in tours_data}
+            if len(daret_ids) != Daret.objects.filter(id__in=daret_ids).count():
+                return Response({'success': False, 'message': 'Daret matching query does not exist.'}, status=404)
+            if len(user_ids) != User.objects.filter(id__in=user_ids).count():
+                return Response({'success': False, 'message': 'User matching query does not exist.'}, status=404)
+
+            # Only the owner arranges the Tours of a Daret
+            if any(get_daret_role(request.user, daret_id) != ROLE_OWNER for daret_id in daret_ids):
+                return Response({'success': False, 'message': 'You are not authorized to manage this Daret.'}, status=403)
+
+            upsert_tours(tours_data)
 
             return Response({'success': True, 'message': 'Tours updated/created successfully'}, status=201)
 
@@ -112,15 +105,29 @@ class ManageTourView(APIAccessMixin, APIView):
         if not id_tour:
             return Response({'success': False, 'message': 'Tour ID is required'}, status=400)
 
+        ordre = data.pop('ordre', None) if isinstance(data, dict) else None
+        if ordre is not None:
+            try:
+                ordre = int(ordre)
+            except (TypeError, ValueError):
+                return Response({'success': False, 'message': {'ordre': ['A valid integer is required.']}}, status=400)
+
         try:
             tour = Tour.objects.get(pk=id_tour)
             serializer = TourSerializer(tour, data=data, partial=True)
             if serializer.is_valid():
-                serializer.save()
+                with transaction.atomic():
+                    serializer.save()
+                    # ordre is a rank in the payout order, moving there rewrites the position
+                    if ordre is not None:
+                        move_tour_to(tour, ordre)
                 return Response({'success': True, 'message': 'Tour updated successfully'}, status=200)
             return Response({'success': False, 'message': serializer.errors}, status=400)
         except Tour.DoesNotExist:
             return Response({'success': False, 'message': 'Tour not found'}, status=404)
+        except ValueError as e:
+            # Raised by move_tour_to for Tours that cannot move
+            return Response({'success': False, 'message': str(e)}, status=400)
         except Exception as e:
             return Response({'success': False, 'message': str(e)}, status=500)
 
@@ -139,9 +146,73 @@ class ManageTourView(APIAccessMixin, APIView):
             return Response({'success': False, 'message': str(e)}, status=500)
 
 
+class ScheduleTourView(APIAccessMixin, APIView):
+    """Schedule all Tours of a Daret"""
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, HasDaretRole]
+    daret_url_kwarg = 'id_daret'
+    daret_roles = {'POST': OWNER_ROLES}
+
+    def post(self, request, id_daret, *args, **kwargs):
+        """Generate or regenerate the rotation of a Daret from its members"""
+        daret = get_object_or_404(Daret, pk=id_daret)
+        try:
+            tours = generate_schedule(daret)
+            return Response({'success': True, 'message': f'{len(tours)} Tours scheduled successfully'}, status=200)
+        except Exception as e:
+            return Response({'success': False, 'message': str(e)}, status=500)
+
+
+class OpenTourView(APIAccessMixin, APIView):
+    """Open a Tour for payment"""
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, HasDaretRole]
+    daret_roles = {'POST': OWNER_ROLES}
+
+    def post(self, request, id_tour, *args, **kwargs):
+        """Create the ConfirmVirement of every donor of the Tour"""
+        tour = get_object_or_404(Tour, pk=id_tour)
+        self.check_object_permissions(request, tour)
+
+        try:
+            count = open_tours([tour])
+            return Response({'success': True, 'message': f'Tour opened for {count} donors'}, status=200)
+        except Exception as e:
+            return Response({'success': False, 'message': str(e)}, status=500)
+
+
+class MoveTourView(APIAccessMixin, APIView):
+    """Move a Tour in the payout order of its Daret"""
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated, HasDaretRole]
+    daret_roles = {'POST': OWNER_ROLES}
+
+    def post(self, request, id_tour, *args, **kwargs):
+        """Place the Tour right before or after another Tour of the same Daret"""
+        tour = get_object_or_404(Tour, pk=id_tour)
+        self.check_object_permissions(request, tour)
+
+        after = 'after' in request.data
+        target_id = request.data.get('after' if after else 'before')
+        if target_id is None:
+            return Response({'success': False, 'message': 'Provide before or after'}, status=400)
+
+        target = Tour.objects.filter(pk=target_id, daret_id=tour.daret_id).first()
+        if target is None or target.pk == tour.pk:
+            return Response({'success': False, 'message': 'Tour not found in this Daret'}, status=404)
+
+        try:
+            move_tour(tour, target, after=after)
+            return Response({'success': True, 'message': 'Tour moved successfully'}, status=200)
+        except ValueError as e:
+            return Response({'success': False, 'message': str(e)}, status=400)
+        except Exception as e:
+            return Response({'success': False, 'message': str(e)}, status=500)
+
+
 class ManageConfirmVirementView(APIAccessMixin, APIView):
     """Manage ConfirmVirement records"""
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, id_confirm_virement=None, *args, **kwargs):
@@ -162,12 +233,13 @@ class ManageConfirmVirementView(APIAccessMixin, APIView):
                 confirm_virement_instances = ConfirmVirement.objects.filter(
                     partie_beneficiaire=user.id, is_send=False)
 
-                if not confirm_virement_instances.exists():
+                serialized_data = list(
+                    project_confirm_virements(confirm_virement_instances))
+
+                if not serialized_data:
                     return Response({'success': False, 'message': 'No records found.'}, status=200)
 
-                serialized_data = ConfirmVirementSerializer(
-                    confirm_virement_instances, many=True)
-                return Response({'success': True, 'data': serialized_data.data, 'unreadCount': len(serialized_data.data)}, status=200)
+                return Response({'success': True, 'data': serialized_data, 'unreadCount': len(serialized_data)}, status=200)
         except ConfirmVirement.DoesNotExist:
             return Response({'success': False, 'message': 'Confirm Virement not found'}, status=404)
         except Exception as e:
@@ -206,33 +278,91 @@ class ManageConfirmVirementView(APIAccessMixin, APIView):
         except Exception as e:
             return Response({'success': False, 'message': str(e)}, status=500)
 
-    def put(self, request, id_confirm_virement, *args, **kwargs):
-        """Update an existing ConfirmVirement"""
+    def put(self, request, id_confirm_virement=None, *args, **kwargs):
+        """Update an existing ConfirmVirement, or confirm a list of them"""
         if not id_confirm_virement:
-            return Response({'success': False, 'message': 'Confirm Virement ID is required'}, status=400)
+            return self.confirm_many(request)
 
         try:
-            confirm_virement = ConfirmVirement.objects.get(
-                pk=id_confirm_virement)
-            confirm_virement.is_send = True
-            confirm_virement.save()
-
-            create_notification(
-                user_source=confirm_virement.partie_beneficiaire,
-                user_destination=confirm_virement.partie_donnenant,
-                message=(
-                    "Mr {} confirmed that they received money."
-                    .format(confirm_virement.partie_beneficiaire_full_name)
+            confirm_virement = ConfirmVirement.objects.select_related(
+                'partie_beneficiaire', 'tour').get(pk=id_confirm_virement)
+            beneficiaire = confirm_virement.partie_beneficiaire
+            with transaction.atomic():
+                confirm_virement.is_send = True
+                confirm_virement.save()
+
+                # Fanned out by the outbox workers
+                enqueue_notification(
+                    user_source=beneficiaire,
+                    user_destinations=[confirm_virement.partie_donnenant_id],
+                    template=VIREMENT_RECEIVED_TEMPLATE,
+                    params={'first_name': beneficiaire.first_name, 'last_name': beneficiaire.last_name},
+                    kind=VIREMENT_RECEIVED,
+                    daret=confirm_virement.tour.daret_id,
                 )
 
-            )
-
             return Response({'success': True, 'message': 'Confirm Virement updated successfully'}, status=200)
         except ConfirmVirement.DoesNotExist:
             return Response({'success': False, 'message': 'Confirm Virement not found'}, status=404)
         except Exception as e:
             return Response({'success': False, 'message': str(e)}, status=500)
 
+    def confirm_many(self, request):
+        """Confirm every ConfirmVirement listed in 'ids' as received by the current user"""
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            data = None
+        # A JSON array or scalar is valid JSON but not an object
+        if not isinstance(data, dict):
+            return Response({'success': False, 'message': 'Invalid JSON data'}, status=400)
+
+        ids = data.get('ids')
+        if not ids or not isinstance(ids, list):
+            return Response({'success': False, 'message': 'Confirm Virement ID is required'}, status=400)
+
+        try:
+            user = request.user
+            ids = {int(virement_id) for virement_id in ids}
+
+            with transaction.atomic():
+                # Ownership of every virement in one query
+                virements = list(ConfirmVirement.objects.filter(
+                    pk__in=ids, partie_beneficiaire=user
+                ).select_for_update(of=('self',)).values_list('id', 'tour_id', 'tour__daret_id', 'partie_donnenant_id', 'is_send'))
+
+                if len(virements) != len(ids):
+                    return Response({'success': False, 'message': 'You are not authorized to confirm some of these virements.'}, status=403)
+
+                pending = [virement for virement in virements if not virement[4]]
+                ConfirmVirement.objects.filter(pk__in=[virement[0] for virement in pending]).update(
+                    is_send=True, updated_at=timezone.now())
+
+                # Tours and Darets are re-evaluated once, on commit
+                mark_completion_dirty(tour_ids={virement[1] for virement in pending})
+                touch_darets({virement[2] for virement in pending})
+                invalidate_counters(VIREMENTS, [user.id])
+
+                # One batch per Daret, so donors' notifications coalesce per Daret
+                donors = {}
+                for virement in pending:
+                    donors.setdefault(virement[2], []).append(virement[3])
+                for daret_id, donor_ids in donors.items():
+                    enqueue_notification(
+                        user_source=user,
+                        user_destinations=donor_ids,
+                        template=VIREMENT_RECEIVED_TEMPLATE,
+                        params={'first_name': user.first_name, 'last_name': user.last_name},
+                        kind=VIREMENT_RECEIVED,
+                        daret=daret_id,
+                    )
+
+            return Response({'success': True, 'message': f'{len(pending)} Confirm Virements updated successfully'}, status=200)
+        except (TypeError, ValueError):
+            return Response({'success': False, 'message': 'Invalid Confirm Virement ID'}, status=400)
+        except Exception as e:
+            return Response({'success': False, 'message': str(e)}, status=500)
+
     def delete(self, request, id_confirm_virement, *args, **kwargs):
         """Delete a ConfirmVirement"""
         try:
@@ -252,7 +382,7 @@ class ManageConfirmVirementView(APIAccessMixin, APIView):
 
 class CardTourView(APIAccessMixin, APIView):
     """Card Tour of Daret"""
-    authentication_classes = [JWTAuthentication, SessionAuthentication]
+    authentication_classes = [CachedJWTAuthentication, SessionAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, id_confirm_virement=None, *args, **kwargs):
@@ -260,44 +390,8 @@ class CardTourView(APIAccessMixin, APIView):
         try:
             user = request.user
 
-            # Step 1: Filter all Darets the user is participating in and are not done
-            darets = Daret.objects.filter(
-                Q(joinDarets__participant=user, joinDarets__is_confirmed=True), is_done=False)
-            # joinDarets__participant=user, is_done=False)
-
-            serialized_daret = DaretSerializer(darets, many=True)
-
-            # Initialize list to hold combined data for each daret
-            combined_data = []
-            serialized_tours = []
-            daret_virement_data = []
-
-            # Step 2: Iterate through each Daret to fetch associated Tours and ConfirmVirement
-            for daret in darets:
-                # Fetch Tour instances related to this Daret
-                tour_instances = Tour.objects.filter(daret=daret)
-                serialized_tours = TourSerializer(
-                    tour_instances, many=True).data
-
-                # Initialize list for each Daret's virement data
-                daret_virement_data = []
-
-                for tour in tour_instances:
-                    # Fetch ConfirmVirement instances where the user is the donator for this Daret
-                    virement_instances = ConfirmVirement.objects.filter(
-                        tour=tour, partie_donnenant=user
-                    )
-                    serialized_virement = ConfirmVirementSerializer(
-                        virement_instances, many=True).data
-
-                    # Add each virement's data into daret_virement_data
-                    daret_virement_data.extend(serialized_virement)
-
-                # Collect data for each Daret, including tours and virements
-                combined_data.append({
-                    'tours': serialized_tours,
-                    'virements': daret_virement_data
-                })
+            # Tours and virements of running Darets, cached per user
+            combined_data = get_card(user)
 
             # Step 3: Return the combined serialized data
             return Response({